@@ -5,7 +5,10 @@
 import json
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+import functools
+from contextlib import contextmanager
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, session, make_response, Blueprint, stream_with_context, stream_template, jsonify
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 import logging
@@ -13,6 +16,20 @@ from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from flask_migrate import Migrate
+from flask.cli import AppGroup
+import click
+import time
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from search import TrigramIndex
+from cache import LRUCache, makePageCache
+import hashlib
+import base64
+from pool import poolMetrics
+from sqlstats import init_sql_stats
+from importer import RecordError, readRecords, convertRecord, batched, guessFormat, \
+  toDatetime
 from datetime import datetime, timezone
 
 #----------------------------------------------------------------------------#
@@ -23,6 +40,8 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db = SQLAlchemy(app)
+# query counts and times in every response's headers, slow queries logged
+init_sql_stats(app)
 
 migrate = Migrate(app, db)
 
@@ -36,14 +55,20 @@ class Venue(db.Model):
 # child of Area
 # parent to Show
   __tablename__ = 'venues'
+  # trigram index for name search, see migration 3c1a7e9b5d42
+  __table_args__ = (
+    db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin',
+      postgresql_ops={'name': 'gin_trgm_ops'}),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(), nullable=False)
   area_id = db.Column(db.Integer, db.ForeignKey("areas.id"),
-    nullable=False)
+    nullable=False, index=True)
   # city = db.Column(db.String(120), nullable=False)  # implemented by Area
   # state = db.Column(db.String(120), nullable=False) # implemented by Area
-  genres = db.Column(db.ARRAY(db.String(60)), nullable=False)
+  genres = db.Column(db.ARRAY(db.String(60)).with_variant(db.JSON, 'sqlite'),
+    nullable=False)
 
   address = db.Column(db.String(120))
   phone = db.Column(db.String(20))
@@ -53,8 +78,13 @@ class Venue(db.Model):
   image_link = db.Column(db.String(500), nullable=False)
   seeking_talent = db.Column(db.Boolean, default=False)
   seeking_desc = db.Column(db.String())
+  # maintained by the show counter events, see countShow()
+  num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0,
+    server_default='0')
 
-  shows = db.relationship('Show', backref='venue', lazy='joined', cascade='all, delete-orphan')
+  # shows are never loaded along with a venue. views that need them ask for
+  # them explicitly, and any accidental lazy load raises instead of querying.
+  shows = db.relationship('Show', backref='venue', lazy='raise', cascade='all, delete-orphan')
 
   # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
@@ -62,14 +92,20 @@ class Artist(db.Model):
 # child of Area
 # parent to Show
   __tablename__ = 'artists'
+  # trigram index for name search, see migration 3c1a7e9b5d42
+  __table_args__ = (
+    db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin',
+      postgresql_ops={'name': 'gin_trgm_ops'}),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(), nullable=False)
   area_id = db.Column(db.Integer, db.ForeignKey("areas.id"),
-    nullable=False)
+    nullable=False, index=True)
   # city = db.Column(db.String(120), nullable=False)  # implemented by Area
   # state = db.Column(db.String(120), nullable=False) # implemented by Area
-  genres = db.Column(db.ARRAY(db.String(60)), nullable=False)
+  genres = db.Column(db.ARRAY(db.String(60)).with_variant(db.JSON, 'sqlite'),
+    nullable=False)
 
   phone = db.Column(db.String(20))
   website = db.Column(db.String(120))
@@ -78,8 +114,12 @@ class Artist(db.Model):
   image_link = db.Column(db.String(500), nullable=False)
   seeking_venue = db.Column(db.Boolean, default=False)
   seeking_desc = db.Column(db.String())
+  # maintained by the show counter events, see countShow()
+  num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0,
+    server_default='0')
 
-  shows = db.relationship('Show', backref='artist', lazy='joined', cascade='all, delete-orphan')
+  # loaded explicitly where needed, like Venue.shows
+  shows = db.relationship('Show', backref='artist', lazy='raise', cascade='all, delete-orphan')
 
   # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
@@ -94,6 +134,14 @@ class Show(db.Model):
     nullable=False)
   start_time = db.Column(db.DateTime, nullable=False)
 
+  # a venue's or artist's shows are always looked up by time, and the shows
+  # page pages through all shows by (start_time, id), see migration 5b8c3d1e6f20
+  __table_args__ = (
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+  )
+
 class Area(db.Model):
 # parent to Venue and Artist
   __tablename__ = 'areas'
@@ -101,8 +149,25 @@ class Area(db.Model):
   id = db.Column(db.Integer, primary_key=True)
   city = db.Column(db.String(120))
   state = db.Column(db.String(120))
-  venues = db.relationship('Venue', backref='area', lazy='joined')
-  artists = db.relationship('Artist', backref='area', lazy='joined')
+  # getAreaId() relies on this to add areas without duplicates
+  __table_args__ = (
+    db.UniqueConstraint('city', 'state', name='uq_areas_city_state'),
+  )
+  # loaded explicitly where needed, like Venue.shows
+  venues = db.relationship('Venue', backref='area', lazy='raise')
+  artists = db.relationship('Artist', backref='area', lazy='raise')
+
+class ShowCounter(db.Model):
+# single row recording the time up to which shows have been rolled over from
+# the upcoming show counts of their venue and artist
+  __tablename__ = 'show_counter'
+
+  id = db.Column(db.Integer, primary_key=True)
+  rolled_until = db.Column(db.DateTime, nullable=False)
+
+# case-insensitive name lookups and sorting
+db.Index('ix_venues_lower_name', db.func.lower(Venue.name))
+db.Index('ix_artists_lower_name', db.func.lower(Artist.name))
 
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
@@ -110,13 +175,36 @@ class Area(db.Model):
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(str(value))
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
+
+# babel's named formats not in DATETIME_FORMATS. babel joins a date and a
+# time pattern of the locale for them, so they are left to babel rather than
+# parsed as patterns.
+BABEL_FORMATS = ('short', 'long')
+
+# parsing a babel pattern and looking up its locale is most of the cost of
+# formatting a date, so each format/locale pair is only prepared once
+@functools.lru_cache(maxsize=64)
+def getDatetimePattern(format, locale):
+  pattern = DATETIME_FORMATS.get(format, format)
+  return babel.dates.parse_pattern(pattern), babel.Locale.parse(locale)
+
+def format_datetime(value, format='medium', locale='en'):
+  # values from the database are already datetimes; only strings are parsed
+  if isinstance(value, datetime):
+    date = value
+  else:
+    date = dateutil.parser.parse(str(value))
+  # babel treats naive datetimes as utc
+  if date.tzinfo is None:
+    date = date.replace(tzinfo=timezone.utc)
+  if format in BABEL_FORMATS:
+    return babel.dates.format_datetime(date, format, locale=locale)
+  pattern, locale = getDatetimePattern(format, locale)
+  return pattern.apply(date, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
@@ -132,145 +220,686 @@ def index():
 # Helper functions for controllers
 #  ----------------------------------------------------------------
 
-# all time-related logic is encapsulated in the following two helper functions
-
-# takes in an artist or venue object and returns a list of its upcoming shows.
-# if the object passed is not an artist or venue, it returns None.
-def getUpcoming(obj):
-  result = []
-  currentTime = datetime.now(timezone.utc)
-
-  # if object is a venue, query shows by venue id
-  if type(obj) == Venue:
-    shows = Show.query.join(Artist).filter(Show.venue_id == obj.id,
-      Show.start_time > currentTime).all() # list of Show objs
-    for s in shows:
-      data = {
-        'artist_id': s.artist_id,
-        'artist_name': s.artist.name,
-        'artist_image_link': s.artist.image_link,
-        'start_time': s.start_time,
-      }
-      result.append(data)
-  # if object is an artist, query shows by artist id
-  elif type(obj) == Artist:
-    shows = Show.query.join(Venue).filter(Show.artist_id == obj.id,
-      Show.start_time > currentTime).all() # list of Show objs
-    for s in shows:
-      data = {
-        'venue_id': s.venue_id,
-        'venue_name': s.venue.name,
-        'venue_image_link': s.venue.image_link,
-        'start_time': s.start_time,
-      }
-      result.append(data)
-  else: # not an artist or venue, so return none
-    return None
-  return result
+# every show links a venue to an artist. for each of the two, this records
+# the show column pointing at it, the model on the other end of the show and
+# the prefix the templates use for that other side's fields.
+SHOW_PARTNERS = {
+  Venue: (Show.venue_id, Artist, Show.artist_id, 'artist'),
+  Artist: (Show.artist_id, Venue, Show.venue_id, 'venue'),
+}
+
+# the time shows are split at. start times are stored without a timezone,
+# so "now" is a naive UTC datetime to compare against them.
+def getNow():
+  return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# takes in an artist or venue object and returns a (past, upcoming) tuple of
+# lists of its shows. all shows come from one query ordered by start time, so
+# the list is split at the current time in a single pass.
+def getShows(obj):
+  return getShowsOf(type(obj), obj.id)
+
+# the same for the venue or artist with the given id, without loading it
+def getShowsOf(model, id):
+  ownColumn, partner, partnerColumn, prefix = SHOW_PARTNERS[model]
+  rows = db.session.query(partnerColumn, partner.name, partner.image_link,
+      Show.start_time) \
+    .join(partner, partnerColumn == partner.id) \
+    .filter(ownColumn == id) \
+    .order_by(Show.start_time, Show.id) \
+    .all()
+
+  currentTime = getNow()
+  past = []
+  upcoming = []
+  for partnerId, name, imageLink, startTime in rows:
+    data = {
+      prefix + '_id': partnerId,
+      prefix + '_name': name,
+      prefix + '_image_link': imageLink,
+      'start_time': startTime,
+    }
+    if startTime > currentTime:
+      upcoming.append(data)
+    else:
+      past.append(data)
+  return past, upcoming
+
+
+# writes happen in a unit of work, which commits exactly once: the changes
+# made in it are flushed together when it commits at the end of the block,
+# or rolled back if anything in it raises, re-raising the error for the
+# caller to report. units nest, so helpers can open one and still be part of
+# their caller's. used as a decorator, it makes the whole function one unit.
+@contextmanager
+def unitOfWork():
+  session = db.session()
+  if session.info.get('unit_of_work'):
+    yield session
+    return
+
+  session.info['unit_of_work'] = True
+  try:
+    with session.no_autoflush:
+      yield session
+    session.commit()
+  except BaseException:
+    session.rollback()
+    raise
+  finally:
+    session.info.pop('unit_of_work', None)
+
+# flashes why a write failed. integrity errors (a duplicate, or a show of a
+# venue or artist that doesn't exist) are caused by the submitted data, so
+# the database's reason is shown; other errors are logged.
+def flashWriteError(message, error):
+  if isinstance(error, IntegrityError):
+    flash('Error occurred! %s: %s' % (message, error.orig))
+  else:
+    app.logger.error('%s: %s', message, error)
+    flash('Error occurred! %s.' % message)
+
+# venues and artists keep a count of their upcoming shows, so listings and
+# search read it from the venue or artist row instead of counting shows.
+# a show is counted while its start time is after ShowCounter.rolled_until.
+# the counts change with every show written through the ORM, and the
+# `flask fyyur rollover` command, run on a schedule, uncounts the shows that
+# have started since it last ran.
+
+# starts the counters from now if they have never run. the first transaction
+# to get here inserts the row; ones alongside it wait on its insert and then
+# skip theirs, instead of failing on the duplicate id.
+def insertShowCounter(connection):
+  if db.engine.dialect.name == 'postgresql':
+    insert = postgresql.insert
+  else:
+    insert = sqlite.insert
+  connection.execute(insert(ShowCounter)
+    .values(id=1, rolled_until=getNow())
+    .on_conflict_do_nothing(index_elements=['id']))
+
+# returns the time up to which shows have been rolled over, starting the
+# counters from now if they have never run. the row is share-locked so a
+# rollover can't run between reading it and counting a show.
+def getRolledUntil(connection):
+  select = db.select(ShowCounter.rolled_until).with_for_update(read=True)
+  rolledUntil = connection.execute(select).scalar()
+  if rolledUntil is None:
+    insertShowCounter(connection)
+    rolledUntil = connection.execute(select).scalar()
+  return rolledUntil
+
+# adds step to the upcoming show counts of a show's venue and artist, if the
+# show is still counted as upcoming
+def countShow(connection, venueId, artistId, startTime, step):
+  if startTime <= getRolledUntil(connection):
+    return
+  for model, id in ((Venue, venueId), (Artist, artistId)):
+    connection.execute(db.update(model)
+      .where(model.id == id)
+      .values(num_upcoming_shows=model.num_upcoming_shows + step))
+
+@event.listens_for(Show, 'after_insert')
+def countNewShow(mapper, connection, show):
+  countShow(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+@event.listens_for(Show, 'after_delete')
+def uncountDeletedShow(mapper, connection, show):
+  countShow(connection, show.venue_id, show.artist_id, show.start_time, -1)
+
+@event.listens_for(Show, 'after_update')
+def recountUpdatedShow(mapper, connection, show):
+  # uncount the show as it was, then count it as it is now
+  old = {}
+  for key in ('venue_id', 'artist_id', 'start_time'):
+    history = db.inspect(show).attrs[key].history
+    old[key] = history.deleted[0] if history.deleted else getattr(show, key)
+  countShow(connection, old['venue_id'], old['artist_id'], old['start_time'], -1)
+  countShow(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+# locks the counter row for the rest of the transaction, so no show can be
+# counted against the old rollover time while the counts are being changed.
+# the row is locked FOR UPDATE straight away: two runs that both took a share
+# lock first would each wait for the other to release it to upgrade theirs.
+def lockShowCounter():
+  counter = ShowCounter.query.with_for_update().one_or_none()
+  if counter is None:
+    insertShowCounter(db.session.connection())
+    counter = ShowCounter.query.with_for_update().one()
+  return counter
+
+# uncounts the shows that started between the last rollover and now
+@unitOfWork()
+def rolloverShowCounts():
+  counter = lockShowCounter()
+  currentTime = getNow()
+
+  started = db.and_(Show.start_time > counter.rolled_until,
+    Show.start_time <= currentTime)
+  for model, column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    numStarted = db.select(db.func.count(Show.id)) \
+      .where(column == model.id, started) \
+      .scalar_subquery()
+    db.session.execute(db.update(model)
+      .where(model.id.in_(db.select(column).where(started)))
+      .values(num_upcoming_shows=model.num_upcoming_shows - numStarted)
+      .execution_options(synchronize_session=False))
+
+  counter.rolled_until = currentTime
+  # the counts are shown on the listings; detail pages count shows as they
+  # render
+  invalidateAfterCommit('/venues', '/artists')
+
+# counts every venue's and artist's upcoming shows from scratch
+@unitOfWork()
+def recountShows():
+  counter = lockShowCounter()
+  currentTime = getNow()
+
+  for model, column in ((Venue, Show.venue_id), (Artist, Show.artist_id)):
+    numUpcoming = db.select(db.func.count(Show.id)) \
+      .where(column == model.id, Show.start_time > currentTime) \
+      .scalar_subquery()
+    db.session.execute(db.update(model)
+      .values(num_upcoming_shows=numUpcoming)
+      .execution_options(synchronize_session=False))
+
+  counter.rolled_until = currentTime
+  invalidateAfterCommit('/venues', '/artists')
+
+# process-local cache of (city, state) -> area id. ids of areas inserted by
+# the current transaction are only cached once it commits, so a rollback
+# can't leave ids of areas that don't exist in the cache.
+areaIds = LRUCache(app.config['AREA_CACHE_SIZE'])
+
+# an insert into areas that skips areas which already exist
+def insertMissingAreas():
+  if db.engine.dialect.name == 'postgresql':
+    insert = postgresql.insert
+  else:
+    insert = sqlite.insert
+  return insert(Area).on_conflict_do_nothing(index_elements=['city', 'state'])
 
-  # takes in an artist or venue object and returns a list of its upcoming shows.
-  # if the object passed is not an artist or venue, it returns None.
-def getPast(obj):
-  result = []
-  currentTime = datetime.now(timezone.utc)
-
-  # if object is a venue, query shows by venue id
-  if type(obj) == Venue:
-    shows = Show.query.join(Artist).filter(Show.venue_id == obj.id,
-      Show.start_time <= currentTime).all() # list of Show objs
-    for s in shows:
-      data = {
-        'artist_id': s.artist_id,
-        'artist_name': s.artist.name,
-        'artist_image_link': s.artist.image_link,
-        'start_time': s.start_time,
-      }
-      result.append(data)
-
-  # if object is an artist, query shows by artist id
-  elif type(obj) == Artist:
-    shows = Show.query.join(Venue).filter(Show.artist_id == obj.id,
-      Show.start_time <= currentTime).all() # list of Show objs
-    for s in shows:
-      data = {
-        'venue_id': s.venue_id,
-        'venue_name': s.venue.name,
-        'venue_image_link': s.venue.image_link,
-        'start_time': s.start_time,
-      }
-      result.append(data)
+# returns the id of the area with the given city and state, adding the area
+# if it doesn't exist yet. the area is added in the caller's transaction, in
+# a single INSERT ... ON CONFLICT against the unique (city, state) constraint,
+# so concurrent submissions can't create duplicate areas.
+def getAreaId(city, state):
+  key = (city, state)
+  areaId = areaIds.get(key)
+  if areaId is not None:
+    return areaId
 
-  else: # not an artist or venue, so return none
-    return None
+  insert = insertMissingAreas().values(city=city, state=state)
+  if db.engine.dialect.name == 'postgresql':
+    # returns the new id in the same round-trip, or nothing if it existed
+    areaId = db.session.execute(insert.returning(Area.id)).scalar()
+  else:
+    # sqlite can't return the id here, so it is read back below
+    db.session.execute(insert)
+    areaId = None
+  if areaId is None:
+    areaId = db.session.query(Area.id) \
+      .filter_by(city=city, state=state).scalar()
+
+  db.session.info.setdefault('area_ids', {})[key] = areaId
+  return areaId
+
+# returns a dict mapping each of the (city, state) pairs to its area id, adding
+# the missing areas with one multi-row insert and reading them back with one
+# query, however many pairs there are
+def getAreaIds(keys):
+  result = {}
+  missing = []
+  for key in set(keys):
+    areaId = areaIds.get(key)
+    if areaId is None:
+      missing.append(key)
+    else:
+      result[key] = areaId
+
+  if missing:
+    db.session.execute(insertMissingAreas(),
+      [{'city': city, 'state': state} for city, state in missing])
+    rows = db.session.query(Area.id, Area.city, Area.state) \
+      .filter(db.tuple_(Area.city, Area.state).in_(missing)) \
+      .all()
+    pending = db.session.info.setdefault('area_ids', {})
+    for areaId, city, state in rows:
+      result[(city, state)] = pending[(city, state)] = areaId
   return result
 
-
-# search Area objects for one that matches the city and state arguments
-# and return its id, or if the area doesn't exist,
-def getAreaId(city, state):
-  # generate query object for areas matching city and state argument
-  areaQo = Area.query.filter_by(state=state, city=city)
-
-  # if that query returns at least one object, then the city already exists  
-  if areaQo.count() >= 1:
-    # get the id of the area selected by the query.
-    # first() is a simplification, assuming that the model will contain
-    # only one area with that city/state combo. 
-    return areaQo.first().id
+@event.listens_for(db.session, 'after_commit')
+def cacheAreaIds(session):
+  for key, areaId in session.info.pop('area_ids', {}).items():
+    areaIds.set(key, areaId)
+
+@event.listens_for(db.session, 'after_rollback')
+def forgetAreaIds(session):
+  session.info.pop('area_ids', None)
+
+# areas changed through the ORM may no longer match their cached ids
+def dropAreaIds(mapper, connection, target):
+  areaIds.clear()
+
+for e in ('after_update', 'after_delete'):
+  event.listen(Area, e, dropAreaIds)
+
+# in-process trigram indexes of venue and artist names, used for search when
+# the database has no pg_trgm (e.g. sqlite in the tests). an index is dropped
+# whenever a row of its model is written and rebuilt on the next search.
+searchIndexes = {}
+
+def getSearchIndex(model):
+  if model not in searchIndexes:
+    rows = db.session.query(model.id, model.name).all()
+    searchIndexes[model] = TrigramIndex(rows)
+  return searchIndexes[model]
+
+def dropSearchIndex(mapper, connection, target):
+  searchIndexes.pop(type(target), None)
+
+for model in (Venue, Artist):
+  for e in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(model, e, dropSearchIndex)
+
+# escapes the LIKE wildcards in a search term so they match literally
+def escapeLike(term):
+  return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Listings are paged by keyset: each page starts after the sort keys of the
+# last row of the page before, passed along as an opaque cursor. later pages
+# cost the same as the first one, and rows added or removed meanwhile don't
+# shift the rows of later pages around like an offset would.
+
+# returns the value as compact json, with dates and times in iso format
+def dumpJson(value):
+  return json.dumps(value, separators=(',', ':'),
+    default=lambda value: value.isoformat())
+
+# returns the cursor for the given sort keys, safe to use in a url
+def encodeCursor(keys):
+  text = dumpJson(keys)
+  return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+# returns the sort keys of a cursor, converting each with the matching type,
+# or None if there is no cursor. aborts with a 400 for bad cursors.
+def decodeCursor(cursor, *types):
+  if not cursor:
+    return None
+  try:
+    text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    keys = json.loads(text)
+    if not isinstance(keys, list) or len(keys) != len(types):
+      raise ValueError(cursor)
+    return [type(key) for type, key in zip(types, keys)]
+  except (TypeError, ValueError):
+    abort(400)
+
+# iterates over up to limit rows of the query, ordered by the key columns
+# and starting after the row with the given keys. rows are fetched from a
+# server-side cursor in batches of yield_per, each passed through convert
+# as it arrives, so pages can be rendered while they are read. once the rows
+# have been iterated over, next_page is the cursor of the next page, or None
+# if this is the last one. the key columns are compared as one row value;
+# the extra comparison on the first key lets the database range-scan an
+# index on it.
+class KeysetRows:
+  def __init__(self, query, keys, after=None, limit=50, convert=tuple,
+      yield_per=100):
+    if after is not None:
+      query = query.filter(keys[0] >= after[0],
+        db.tuple_(*keys) > db.tuple_(*after))
+    # the keys are selected after the query's own columns and split off
+    # again. one extra row tells whether there is a next page
+    self.query = query.add_columns(*keys).order_by(*keys).limit(limit + 1)
+    self.keys = len(keys)
+    self.limit = limit
+    self.convert = convert
+    self.yieldPer = yield_per
+    self.next_page = None
+
+  def __iter__(self):
+    last = None
+    for i, row in enumerate(self.query.yield_per(self.yieldPer)):
+      if i == self.limit:
+        self.next_page = encodeCursor(list(last))
+        continue
+      last = row[-self.keys:]
+      yield self.convert(tuple(row[:-self.keys]))
+
+# returns a list of up to limit rows of the query, as KeysetRows iterates
+# over them, along with the cursor of the next page or None
+def getKeysetPage(query, keys, after=None, limit=50):
+  rows = KeysetRows(query, keys, after, limit)
+  return list(rows), rows.next_page
+
+# the planner's estimate of a table's rows on postgres. the table name is
+# cast with CAST(), as text() would read :table::regclass as literal text
+# rather than a :table parameter followed by a cast.
+ESTIMATE_ROWS = db.text(
+  'SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)')
+
+# returns the number of rows in the model's table as {'count', 'exact'}.
+# counting is a full scan on postgres, so past COUNT_ESTIMATE_THRESHOLD rows
+# the planner's estimate from the last analyze is used instead.
+def countRows(model):
+  if db.engine.dialect.name == 'postgresql':
+    estimate = db.session.execute(ESTIMATE_ROWS,
+      {'table': model.__tablename__}).scalar()
+    if estimate is not None and \
+        estimate >= app.config['COUNT_ESTIMATE_THRESHOLD']:
+      return {'count': estimate, 'exact': False}
+  return {'count': db.session.query(db.func.count(model.id)).scalar(),
+    'exact': True}
+
+# the condition for names containing the term or similar to it, matched
+# through the trigram indexes on postgres
+def nameMatches(model, term):
+  pattern = '%' + escapeLike(term) + '%'
+  return db.or_(model.name.ilike(pattern, escape='\\'),
+    model.name.op('%')(term))
+
+# searches venue or artist names for the term and returns one page of dicts
+# with each match's id, name and number of upcoming shows, best matches first,
+# along with the cursor of the next page or None. pages are keyed on
+# (-similarity, lower(name), id). on postgres, the matches are found through
+# the trigram indexes and ranked in the same query that reads the upcoming
+# show counts.
+def searchByName(model, term, limit, after=None):
+  query = db.session.query(model.id, model.name, model.num_upcoming_shows)
+
+  if db.engine.dialect.name == 'postgresql':
+    if after is not None:
+      # similarity() is a real; compare the cursor's score as one too
+      after = [db.cast(after[0], db.REAL)] + after[1:]
+    rows, nextPage = getKeysetPage(
+      query.filter(nameMatches(model, term)),
+      [-db.func.similarity(model.name, term), db.func.lower(model.name),
+        model.id],
+      after, limit)
   else:
-    # query found no objects matching city and state, so it needs to be added
-    newArea = Area(city=city, state=state)
-    db.session.add(newArea)
-    db.session.commit()
-    areaId = newArea.id
-    # no session.close here because it's always called from inside a function
-    # that itself ends in a commit and close.
-    return areaId
+    ranked = getSearchIndex(model).search(term, limit + 1, after)
+    rank = dict((id, i) for i, (id, score) in enumerate(ranked))
+    rows = query.filter(model.id.in_(rank)).all()
+    rows.sort(key=lambda row: rank[row[0]])
+    nextPage = None
+    if len(rows) > limit:
+      rows = rows[:limit]
+      nextPage = encodeCursor([-ranked[limit - 1][1], rows[-1][1].lower(),
+        rows[-1][0]])
 
-# takes in a venue or artist and returns a dict containing the object's id, name,
-# and number of upcoming shows, as is required for a few different endpoints.
-# if the function is called on something other than an artist or object, it
-# returns None.
-def getIdNameUpcoming(obj):
-  if type(obj) == Artist or type(obj) == Venue:
-    result = {
-      'id': obj.id,
-      'name': obj.name,
-      # call helper function to get a list of upcoming shows, then get length
-      # of the list to count number of shows
-      'num_upcoming_shows': len(getUpcoming(obj))
-    }
-    return result
+  result = []
+  for id, name, upcoming in rows:
+    result.append({
+      'id': id,
+      'name': name,
+      'num_upcoming_shows': upcoming
+    })
+  return result, nextPage
+
+# returns the number of names matching the term as {'count', 'exact'},
+# counting no further than SEARCH_COUNT_LIMIT matches
+def countMatches(model, term):
+  limit = app.config['SEARCH_COUNT_LIMIT']
+  if db.engine.dialect.name == 'postgresql':
+    matches = db.session.query(model.id) \
+      .filter(nameMatches(model, term)) \
+      .limit(limit + 1) \
+      .subquery()
+    count = db.session.query(db.func.count()).select_from(matches).scalar()
   else:
-    return None
+    count = len(getSearchIndex(model).search(term, limit + 1))
+  return {'count': min(count, limit), 'exact': count <= limit}
+
+# returns a page of search results as {'count', 'exact', 'data'} and the
+# cursor of the next page. the first page counts the matches unless they all
+# fit on it.
+def searchPage(model, term, cursor, limit):
+  after = decodeCursor(cursor, float, str, int)
+  data, nextPage = searchByName(model, term, limit, after)
+
+  if after is None and nextPage is None:
+    results = {'count': len(data), 'exact': True}
+  else:
+    results = countMatches(model, term)
+  results['data'] = data
+  return results, nextPage
+
+# builds the area -> venues -> num_upcoming_shows tree for the venues page
+# from one page of venues, read in a single query, so a page costs one
+# round-trip no matter how many venues there are. areas without venues are
+# left out by the inner join; areas spanning two pages are listed on both.
+def getVenueRows(after=None, limit=50):
+  return KeysetRows(
+    db.session.query(Area.id, Area.city, Area.state, Venue.id,
+        Venue.name, Venue.num_upcoming_shows) \
+      .join(Venue, Venue.area_id == Area.id),
+    [Area.state, Area.city, Area.id, Venue.id],
+    after, limit)
+
+# yields the areas of the venue rows as dicts holding their venues, each
+# area once the rows have moved on to the next
+def groupByArea(rows):
+  areaData = None
+  for areaId, city, state, venueId, venueName, upcoming in rows:
+    # rows arrive sorted by area, so a new area id starts a new group
+    if areaData is None or areaData['id'] != areaId:
+      if areaData is not None:
+        yield areaData
+      areaData = {
+        'id': areaId,
+        'city': city,
+        'state': state,
+        'venues': []
+      }
+    areaData['venues'].append({
+      'id': venueId,
+      'name': venueName,
+      'num_upcoming_shows': upcoming
+    })
+  if areaData is not None:
+    yield areaData
+
+# returns one page of the tree as a list, and the cursor of the next page
+def getVenuesByArea(after=None, limit=50):
+  rows = getVenueRows(after, limit)
+  return list(groupByArea(rows)), rows.next_page
+
+def showData(row):
+  showId, startTime, venueId, venueName, artistId, artistName, \
+    artistImage = row
+  return {
+    'id': showId,
+    'venue_id': venueId,
+    'venue_name': venueName,
+    'artist_id': artistId,
+    'artist_name': artistName,
+    'artist_image_link': artistImage,
+    'start_time': startTime
+  }
+
+# iterates over one page of shows ordered by (start_time, id), as dicts.
+# only the columns the shows page renders are selected, joined in one query.
+def getShowRows(after=None, limit=30):
+  return KeysetRows(
+    db.session.query(Show.id, Show.start_time, Show.venue_id,
+        Venue.name, Show.artist_id, Artist.name, Artist.image_link) \
+      .join(Venue, Show.venue_id == Venue.id) \
+      .join(Artist, Show.artist_id == Artist.id),
+    [Show.start_time, Show.id],
+    after, limit, showData)
+
+# returns one page of shows as a list, along with the cursor of the next
+# page, or None if this is the last page
+def getShowsPage(after=None, limit=30):
+  rows = getShowRows(after, limit)
+  return list(rows), rows.next_page
+
+# cache of rendered listing and detail pages. the handlers that write drop
+# the pages their changes show up on, see pagesShowing().
+pageCache = makePageCache(app.config)
+
+# passes the chunks of a streamed page through, caching the page under the
+# key once the last chunk is sent. pages cut short are not cached.
+def cacheStream(key, mimetype, chunks):
+  parts = []
+  for chunk in chunks:
+    parts.append(chunk)
+    yield chunk
+  body = b''.join(parts)
+  pageCache.set(key, (body, mimetype, hashlib.sha1(body).hexdigest()))
+
+# drops the cached pages once the current transaction commits, so pages
+# rendered meanwhile can't cache the old data under the new generation, and
+# a rolled back write drops nothing
+def invalidateAfterCommit(*paths):
+  db.session.info.setdefault('pages', []).extend(paths)
+
+@event.listens_for(db.session, 'after_commit')
+def invalidateCommittedPages(session):
+  pageCache.invalidate(*session.info.pop('pages', []))
+
+@event.listens_for(db.session, 'after_rollback')
+def forgetPages(session):
+  session.info.pop('pages', None)
+
+# serves the page from the cache when it can, and caches it otherwise. every
+# cached page has an ETag, so browsers revalidating it get a 304.
+def cachedPage(view):
+  @functools.wraps(view)
+  def wrapper(*args, **kwargs):
+    # pages rendered while a message is flashed show that message, so they
+    # are neither served from nor stored in the cache
+    if not app.config['PAGE_CACHE'] or session.get('_flashes'):
+      return view(*args, **kwargs)
+
+    key = pageCache.key(request.path, request.query_string.decode())
+    page = pageCache.get(key)
+    if page is None:
+      response = make_response(view(*args, **kwargs))
+      if response.status_code != 200:
+        return response
+      if response.is_streamed:
+        # streamed pages are sent as they render, without an etag, and
+        # cached once they have been sent in full
+        response.response = cacheStream(key, response.mimetype,
+          response.iter_encoded())
+        response.cache_control.no_cache = True
+        return response
+      body = response.get_data()
+      page = (body, response.mimetype, hashlib.sha1(body).hexdigest())
+      pageCache.set(key, page)
+
+    body, mimetype, etag = page
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # browsers check back every time, cheaply thanks to the etag
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+  return wrapper
+
+# listing path of each model whose pages are cached
+PAGE_PATHS = {Venue: '/venues', Artist: '/artists'}
+
+# returns the paths of the cached pages that show the venue or artist with
+# the given id: its listing, its own page, the shows page and the pages of
+# the venues or artists it has shows with. call this before the change, so
+# deleted shows are still there to find the pages they were on.
+def pagesShowing(model, id):
+  ownColumn, partner, partnerColumn, prefix = SHOW_PARTNERS[model]
+  partnerIds = db.session.query(partnerColumn) \
+    .filter(ownColumn == id) \
+    .distinct()
+  paths = [PAGE_PATHS[model], '%s/%d' % (PAGE_PATHS[model], id), '/shows']
+  for partnerId, in partnerIds:
+    paths.append('%s/%d' % (PAGE_PATHS[partner], partnerId))
+  return paths
+
+#  Bulk loading
+#  ----------------------------------------------------------------
+# used by `flask fyyur import` to load large files in batched transactions
+
+BULK_MODELS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+# inserts a batch of records converted by importer.convertRecord() and
+# commits them. rows are sent with executemany, grouped by the fields they
+# have, and the areas and show counts they need are updated in bulk too.
+def importBatch(kind, records):
+  model = BULK_MODELS[kind]
+  with unitOfWork():
+    insertBatch(model, records)
+    invalidateAfterCommit(*pagesImported(model, records))
+  # these inserts skip the ORM events, so drop the search index here
+  searchIndexes.pop(model, None)
+
+# returns the paths of the cached pages that imported records show up on:
+# the listing of new venues or artists, and for new shows the shows page,
+# the listings counting them and the pages of their venues and artists
+def pagesImported(model, records):
+  if model is not Show:
+    return [PAGE_PATHS[model]]
+  paths = set(['/shows'] + list(PAGE_PATHS.values()))
+  for r in records:
+    paths.add('%s/%d' % (PAGE_PATHS[Venue], r['venue_id']))
+    paths.add('%s/%d' % (PAGE_PATHS[Artist], r['artist_id']))
+  return sorted(paths)
+
+def insertBatch(model, records):
+  connection = db.session.connection()
+
+  if model is not Show:
+    areas = getAreaIds((r['city'], r['state']) for r in records)
+
+  groups = {}
+  for record in records:
+    row = dict(record)
+    if model is not Show:
+      row['area_id'] = areas[(row.pop('city'), row.pop('state'))]
+    if 'seeking_description' in row:
+      row['seeking_desc'] = row.pop('seeking_description')
+    groups.setdefault(frozenset(row), []).append(row)
+  for rows in groups.values():
+    connection.execute(db.insert(model.__table__), rows)
+
+  if model is Show:
+    # count the new upcoming shows, one update per venue and per artist
+    rolledUntil = getRolledUntil(connection)
+    for counted, key in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+      counts = {}
+      for r in records:
+        if r['start_time'] > rolledUntil:
+          counts[r[key]] = counts.get(r[key], 0) + 1
+      if counts:
+        table = counted.__table__
+        connection.execute(db.update(table)
+          .where(table.c.id == db.bindparam('counted_id'))
+          .values(num_upcoming_shows=table.c.num_upcoming_shows +
+            db.bindparam('new_shows')),
+          [{'counted_id': id, 'new_shows': n} for id, n in counts.items()])
+
+# moves a postgres id sequence past rows that were imported with explicit ids
+def resetIdSequence(kind):
+  if db.engine.dialect.name == 'postgresql':
+    with unitOfWork():
+      db.session.execute(db.text(
+        "SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+        "(SELECT max(id) FROM {}))".format(kind)), {'table': kind})
 
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@cachedPage
 def venues():
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
-  
-  data = []
-  areas = Area.query.order_by('state').order_by('city').all()
-
-  for a in areas: # loop through all areas
-    if len(a.venues) > 0: # only show them if they contain venues
-      areaData = {
-      'city':  a.city,
-      'state': a.state,
-      'venues': []
-      }
-      for v in a.venues:
-        # call helper function to generate a dict with just the venue data
-        # needed by the response
-        venueData = getIdNameUpcoming(v)
-        # append to the list of venues that is stored in the areaData dict
-        areaData['venues'].append(venueData)
-      data.append(areaData) # add area to the result
+  # areas, their venues and each venue's upcoming show count all come from
+  # one grouped query instead of a query per venue, a page at a time
+  # the page is streamed as the rows are read
+  after = decodeCursor(request.args.get('after'), str, str, int, int)
+  rows = getVenueRows(after, app.config['VENUES_PER_PAGE'])
 
-  return render_template('pages/venues.html', areas=data)
+  return stream_template('pages/venues.html', areas=groupByArea(rows),
+    total=countRows(Venue), page=rows)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
@@ -278,28 +907,24 @@ def search_venues():
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
 
-  search = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search}%')).all()
-  count = len(venues)
-
-  venueResult = []
-  for v in venues:
-    venueResult.append(getIdNameUpcoming(v))
-
-  response = {'count': count, 'data': venueResult}
+  # matches, ranks and reads upcoming show counts in one query per page
+  response, nextPage = searchPage(Venue, request.form.get('search_term', ''),
+    request.form.get('after'), app.config['SEARCH_RESULTS_PER_PAGE'])
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''), next_page=nextPage)
 
 @app.route('/venues/<int:venue_id>')
+@cachedPage
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
 
-  venue = Venue.query.get(venue_id)
+  # the area is joined in since the page shows its city and state
+  venue = Venue.query.options(db.joinedload(Venue.area)).get(venue_id)
 
-  past = getPast(venue) # function returns list of past shows
-  future = getUpcoming(venue) # function returns list of upcoming shows
-  area = Area.query.get(venue.area_id)
+  # one query returns both lists of shows, split at the current time
+  past, future = getShows(venue)
+  area = venue.area
 
   data = {
     "id": venue.id,
@@ -339,7 +964,6 @@ def create_venue_submission():
   
   city = request.form.get('city')
   state = request.form.get('state')
-  areaId = getAreaId(city, state)
 
   address = request.form.get('address')
   phone = request.form.get('phone')
@@ -348,48 +972,55 @@ def create_venue_submission():
   fbLink = request.form.get('facebook_link')
 
   try:
-    newVenue = Venue(name=name, area_id=areaId, address=address, phone=phone,
-      genres=genres, image_link=imgLink, facebook_link=fbLink)
-    db.session.add(newVenue)
-    db.session.commit()
+    # the area and the venue are written in one transaction
+    with unitOfWork():
+      newVenue = Venue(name=name, area_id=getAreaId(city, state),
+        address=address, phone=phone, genres=genres, image_link=imgLink,
+        facebook_link=fbLink)
+      db.session.add(newVenue)
+      invalidateAfterCommit('/venues')
 
     # on successful db insert, flash success
     flash('Venue ' + name + ' was successfully listed!')
 
-  except:
-    db.session.rollback()
+  except SQLAlchemyError as e:
     # TODO: on unsuccessful db insert, flash an error instead.
     # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-    flash('Error occurred! Venue ' + name + ' was not listed.')
+    flashWriteError('Venue ' + name + ' was not listed', e)
 
-  finally:
-    db.session.close()
-    return render_template('pages/home.html')
+  return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@app.route('/venues/<int:venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # TODO: Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
 
+  # the shows have to be loaded for the delete to cascade to them
+  venue = Venue.query.options(db.selectinload(Venue.shows)).get(venue_id)
+  if venue is None:
+    abort(404)
+  name = venue.name
+
   try:
-    db.session.delete(Venue.query.get(venue_id))
-    db.session.commit()
-    flash('Venue ' + name + ' was successfully deleted.')
-  except:
-    db.session.rollback()
-    flash('Error occurred! Venue ' + name + ' was not deleted.')
-  finally:
-    db.session.close()
-  return None
+    with unitOfWork():
+      invalidateAfterCommit(*pagesShowing(Venue, venue.id))
+      db.session.delete(venue)
+  except SQLAlchemyError as e:
+    flashWriteError('Venue ' + name + ' was not deleted', e)
+    return jsonify({'success': False}), 500
+
+  flash('Venue ' + name + ' was successfully deleted.')
+  return jsonify({'success': True, 'deleted': venue_id})
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  venue = Venue.query.get(venue_id)
-  area = Area.query.get(venue.area_id)
+  # the area is joined in since the page shows its city and state
+  venue = Venue.query.options(db.joinedload(Venue.area)).get(venue_id)
+  area = venue.area
 
   data = {
     "id": venue.id,
@@ -417,34 +1048,35 @@ def edit_venue_submission(venue_id):
   # venue record with ID <venue_id> using the new attributes
 
   venue = Venue.query.get(venue_id)
+  if venue is None:
+    abort(404)
+  name = request.form.get('name')
 
   try:
-    # update model object with new data from form
-    venue.name = request.form.get('name')
-    
-    city = request.form.get('city')
-    state = request.form.get('state')
-    venue.area_id = getAreaId(city, state)
-
-    venue.address = request.form.get('address')
-    venue.phone = request.form.get('phone')
-    venue.genres = request.form.getlist('genres')
-    venue.image_link = request.form.get('image_link')
-    venue.facebook_link = request.form.get('facebook_link')
-
-    venue.website = request.form.get('website')
-    venue.seeking_talent = bool(request.form.get('seeking_talent'))
-    venue.seeking_desc = request.form.get('seeking_description')
-
-    # commit update
-    db.session.commit()
-    flash('Venue ' + venue.name + ' was successfully updated!')
-  except:
-    # if commit fails, roll back changes
-    db.session.rollback()
-    flash('Error occurred! Venue ' + venue.name + ' was not updated.')
-  finally:
-    db.session.close()
+    with unitOfWork():
+      # update model object with new data from form
+      venue.name = name
+
+      city = request.form.get('city')
+      state = request.form.get('state')
+      venue.area_id = getAreaId(city, state)
+
+      venue.address = request.form.get('address')
+      venue.phone = request.form.get('phone')
+      venue.genres = request.form.getlist('genres')
+      venue.image_link = request.form.get('image_link')
+      venue.facebook_link = request.form.get('facebook_link')
+
+      venue.website = request.form.get('website')
+      venue.seeking_talent = bool(request.form.get('seeking_talent'))
+      venue.seeking_desc = request.form.get('seeking_description')
+
+      # the pages showing it are dropped once the update commits
+      invalidateAfterCommit(*pagesShowing(Venue, venue_id))
+    flash('Venue ' + name + ' was successfully updated!')
+  except SQLAlchemyError as e:
+    # the unit of work has rolled back the changes
+    flashWriteError('Venue ' + name + ' was not updated', e)
 
   return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -452,20 +1084,22 @@ def edit_venue_submission(venue_id):
 #  ----------------------------------------------------------------
 
 @app.route('/artists')
+@cachedPage
 def artists():
   # TODO: replace with real data returned from querying the database
   
-  data = []
-  artists = Artist.query.order_by('name').all()
-  
-  for a in artists:
-    artistData = {
-      'id': a.id,
-      'name': a.name
-    }
-    data.append(artistData)
-
-  return render_template('pages/artists.html', artists=data)
+  # only the id and name are listed, so only those columns are fetched.
+  # sorted regardless of case, a page at a time along the lower(name) index,
+  # and streamed as the rows are read
+  after = decodeCursor(request.args.get('after'), str, int)
+  data = KeysetRows(
+    db.session.query(Artist.id, Artist.name),
+    [db.func.lower(Artist.name), Artist.id],
+    after, app.config['ARTISTS_PER_PAGE'],
+    lambda row: {'id': row[0], 'name': row[1]})
+
+  return stream_template('pages/artists.html', artists=data,
+    total=countRows(Artist), page=data)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
@@ -473,28 +1107,24 @@ def search_artists():
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
 
-  search = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search}%')).all()
-  count = len(artists)
-
-  artistResult = []
-  for a in artists:
-    artistResult.append(getIdNameUpcoming(a))
+  # matches, ranks and reads upcoming show counts in one query per page
+  response, nextPage = searchPage(Artist, request.form.get('search_term', ''),
+    request.form.get('after'), app.config['SEARCH_RESULTS_PER_PAGE'])
 
-  response = {'count': count, 'data': artistResult}
-
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''), next_page=nextPage)
 
 @app.route('/artists/<int:artist_id>')
+@cachedPage
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
   
-  artist = Artist.query.get(artist_id)
+  # the area is joined in since the page shows its city and state
+  artist = Artist.query.options(db.joinedload(Artist.area)).get(artist_id)
 
-  past = getPast(artist) # function returns list of past shows
-  future = getUpcoming(artist) # function returns list of upcoming shows
-  area = Area.query.get(artist.area_id)
+  # one query returns both lists of shows, split at the current time
+  past, future = getShows(artist)
+  area = artist.area
 
   data = {
     "id": artist.id,
@@ -520,8 +1150,9 @@ def show_artist(artist_id):
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):  
-  artist = Artist.query.get(artist_id)
-  area = Area.query.get(artist.area_id)
+  # the area is joined in since the page shows its city and state
+  artist = Artist.query.options(db.joinedload(Artist.area)).get(artist_id)
+  area = artist.area
 
   data = {
     "id": artist.id,
@@ -549,33 +1180,34 @@ def edit_artist_submission(artist_id):
   # artist record with ID <artist_id> using the new attributes
 
   artist = Artist.query.get(artist_id)
+  if artist is None:
+    abort(404)
+  name = request.form.get('name')
 
   try:
-    # update model object with new data from form
-    artist.name = request.form.get('name')
-    
-    city = request.form.get('city')
-    state = request.form.get('state')
-    artist.area_id = getAreaId(city, state)
-
-    artist.phone = request.form.get('phone')
-    artist.genres = request.form.getlist('genres')
-    artist.image_link = request.form.get('image_link')
-    artist.facebook_link = request.form.get('facebook_link')
-
-    artist.website = request.form.get('website')
-    artist.seeking_venue = bool(request.form.get('seeking_venue'))
-    artist.seeking_desc = request.form.get('seeking_description')
-  
-    # commit update
-    db.session.commit()
-    flash('Artist ' + artist.name + ' was successfully updated!')
-  except:
-    # if commit fails, roll back changes
-    db.session.rollback()
-    flash('Error occurred! Artist ' + artist.name + ' was not updated.')
-  finally:
-    db.session.close()
+    with unitOfWork():
+      # update model object with new data from form
+      artist.name = name
+
+      city = request.form.get('city')
+      state = request.form.get('state')
+      artist.area_id = getAreaId(city, state)
+
+      artist.phone = request.form.get('phone')
+      artist.genres = request.form.getlist('genres')
+      artist.image_link = request.form.get('image_link')
+      artist.facebook_link = request.form.get('facebook_link')
+
+      artist.website = request.form.get('website')
+      artist.seeking_venue = bool(request.form.get('seeking_venue'))
+      artist.seeking_desc = request.form.get('seeking_description')
+
+      # the pages showing it are dropped once the update commits
+      invalidateAfterCommit(*pagesShowing(Artist, artist_id))
+    flash('Artist ' + name + ' was successfully updated!')
+  except SQLAlchemyError as e:
+    # the unit of work has rolled back the changes
+    flashWriteError('Artist ' + name + ' was not updated', e)
 
   return redirect(url_for('show_artist', artist_id=artist_id))
 
@@ -598,7 +1230,6 @@ def create_artist_submission():
   
   city = request.form.get('city')
   state = request.form.get('state')
-  areaId = getAreaId(city, state)
 
   phone = request.form.get('phone')
   genres = request.form.getlist('genres')
@@ -606,23 +1237,21 @@ def create_artist_submission():
   fbLink = request.form.get('facebook_link')
 
   try:
-    newArtist = Artist(name=name, area_id=areaId, phone=phone,
-      genres=genres, image_link=imgLink, facebook_link=fbLink)
-    db.session.add(newArtist)
-    db.session.commit()
+    # the area and the artist are written in one transaction
+    with unitOfWork():
+      newArtist = Artist(name=name, area_id=getAreaId(city, state),
+        phone=phone, genres=genres, image_link=imgLink, facebook_link=fbLink)
+      db.session.add(newArtist)
+      invalidateAfterCommit('/artists')
 
     # on successful db insert, flash success
     flash('Artist ' + name + ' was successfully listed!')
 
-  except:
-    db.session.rollback()
+  except SQLAlchemyError as e:
     # TODO: on unsuccessful db insert, flash an error instead.
     # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-    flash('Error occurred! Artist ' + name + ' was not listed.')
-
-  finally:
-    db.session.close()
+    flashWriteError('Artist ' + name + ' was not listed', e)
 
   # on successful db insert, flash success
   # flash('Artist ' + request.form['name'] + ' was successfully listed!')
@@ -636,27 +1265,16 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@cachedPage
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  #       num_shows should be aggregated based on number of upcoming shows per venue.
+  # displays list of shows at /shows, one page at a time.
+  # the page is keyed on the (start_time, id) of the last show already seen,
+  # so later pages cost the same as the first one.
+  # the page is streamed as the rows are read
+  after = decodeCursor(request.args.get('after'), datetime.fromisoformat, int)
+  data = getShowRows(after, app.config['SHOWS_PER_PAGE'])
 
-  data = []
-  shows = Show.query.order_by('id').all()
-  
-  for s in shows:
-    artist = Artist.query.get(s.artist_id)
-    showData = {
-      'venue_id': s.venue_id,
-      'venue_name': Venue.query.get(s.venue_id).name,
-      'artist_id': s.artist_id,
-      'artist_name': artist.name,
-      'artist_image_link': artist.image_link,
-      'start_time': s.start_time
-    }
-    data.append(showData)
-
-  return render_template('pages/shows.html', shows=data)
+  return stream_template('pages/shows.html', shows=data, page=data)
 
 @app.route('/shows/create')
 def create_shows():
@@ -674,23 +1292,28 @@ def create_show_submission():
   start_time = request.form.get('start_time')
 
   try:
-    newShow = Show(artist_id=artist_id, venue_id=venue_id, 
-      start_time=start_time)
-    db.session.add(newShow)
-    db.session.commit()
+    # parsed here so the show counters can compare it, as naive utc like
+    # the start times they are compared with
+    start_time = toDatetime(start_time)
+    with unitOfWork():
+      newShow = Show(artist_id=artist_id, venue_id=venue_id, 
+        start_time=start_time)
+      db.session.add(newShow)
+      # the venues listing shows upcoming show counts
+      invalidateAfterCommit('/shows', '/venues',
+        '/venues/%s' % venue_id, '/artists/%s' % artist_id)
 
     # on successful db insert, flash success
     flash('Show was successfully listed!')
 
-  except:
-    db.session.rollback()
+  except (ValueError, OverflowError):
+    flash('Error occurred! Show was not listed: %r is not a start time.'
+      % request.form.get('start_time'))
+  except SQLAlchemyError as e:
     # TODO: on unsuccessful db insert, flash an error instead.
     # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
     # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-    flash('Error occurred! Show was not listed.')
-
-  finally:
-    db.session.close()
+    flashWriteError('Show was not listed', e)
 
 
   # TODO: on unsuccessful db insert, flash an error instead.
@@ -698,6 +1321,15 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+# connection pool statistics in the prometheus text format, to tell stalls
+# waiting for a connection from slow queries
+@app.route('/metrics')
+def metrics():
+  lines = ['fyyur_%s %s' % (name, value)
+    for name, value in poolMetrics(db.engine.pool)]
+  return Response(''.join(line + '\n' for line in lines),
+    mimetype='text/plain')
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -717,6 +1349,238 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# API.
+#----------------------------------------------------------------------------#
+
+# /api/v1 serves the same data as the pages as json. records are read as rows
+# of just the columns sent, never as full ORM objects, and each *_FIELDS dict
+# maps the keys of a record to the columns they are read from.
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+AREA_FIELDS = {'city': Area.city, 'state': Area.state}
+
+VENUE_SUMMARY_FIELDS = {
+  'id': Venue.id,
+  'name': Venue.name,
+  **AREA_FIELDS,
+  'num_upcoming_shows': Venue.num_upcoming_shows,
+}
+
+VENUE_FIELDS = {
+  **VENUE_SUMMARY_FIELDS,
+  'genres': Venue.genres,
+  'address': Venue.address,
+  'phone': Venue.phone,
+  'website': Venue.website,
+  'facebook_link': Venue.facebook_link,
+  'seeking_talent': Venue.seeking_talent,
+  'seeking_description': Venue.seeking_desc,
+  'image_link': Venue.image_link,
+}
+
+ARTIST_SUMMARY_FIELDS = {
+  'id': Artist.id,
+  'name': Artist.name,
+  **AREA_FIELDS,
+  'num_upcoming_shows': Artist.num_upcoming_shows,
+}
+
+ARTIST_FIELDS = {
+  **ARTIST_SUMMARY_FIELDS,
+  'genres': Artist.genres,
+  'phone': Artist.phone,
+  'website': Artist.website,
+  'facebook_link': Artist.facebook_link,
+  'seeking_venue': Artist.seeking_venue,
+  'seeking_description': Artist.seeking_desc,
+  'image_link': Artist.image_link,
+}
+
+SHOW_FIELDS = {
+  'id': Show.id,
+  'start_time': Show.start_time,
+  'venue_id': Show.venue_id,
+  'venue_name': Venue.name,
+  'artist_id': Show.artist_id,
+  'artist_name': Artist.name,
+  'artist_image_link': Artist.image_link,
+}
+
+def selectFields(fields):
+  return db.session.query(*fields.values())
+
+def dumpRow(fields, row):
+  return dict(zip(fields, row))
+
+def jsonResponse(value, status=200):
+  return Response(dumpJson(value), status, mimetype='application/json')
+
+# the page size asked for with ?limit=, up to API_MAX_PAGE_SIZE
+def getLimit():
+  limit = request.args.get('limit', app.config['API_PAGE_SIZE'], type=int)
+  if limit < 1:
+    abort(400)
+  return min(limit, app.config['API_MAX_PAGE_SIZE'])
+
+# lists ask for every record at once with `Accept: application/x-ndjson`
+def wantsStream():
+  return request.accept_mimetypes.best_match(
+    ['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+# returns a list endpoint's response: one page of records as
+# {'data', 'next'}, or every record streamed as ndjson. streamed rows are
+# fetched in batches from a server-side cursor and sent as they arrive, so
+# neither the worker nor the client holds the whole list.
+def listResponse(fields, query, keys, types):
+  if wantsStream():
+    rows = query.order_by(*keys).yield_per(app.config['API_STREAM_BATCH_SIZE'])
+    def generate():
+      for row in rows:
+        yield dumpJson(dumpRow(fields, row)) + '\n'
+    return Response(stream_with_context(generate()),
+      mimetype='application/x-ndjson')
+
+  after = decodeCursor(request.args.get('after'), *types)
+  rows, nextPage = getKeysetPage(query, keys, after, getLimit())
+  return jsonResponse({
+    'data': [dumpRow(fields, row) for row in rows],
+    'next': nextPage
+  })
+
+def searchResponse(model):
+  results, nextPage = searchPage(model, request.args.get('q', ''),
+    request.args.get('after'), getLimit())
+  results['next'] = nextPage
+  return jsonResponse(results)
+
+# returns the venue or artist with its past and upcoming shows
+def detailResponse(model, fields, id):
+  row = selectFields(fields) \
+    .join(Area, model.area_id == Area.id) \
+    .filter(model.id == id) \
+    .first()
+  if row is None:
+    abort(404)
+
+  data = dumpRow(fields, row)
+  data['past_shows'], data['upcoming_shows'] = getShowsOf(model, id)
+  return jsonResponse(data)
+
+@api.route('/venues')
+def api_venues():
+  return listResponse(VENUE_SUMMARY_FIELDS,
+    selectFields(VENUE_SUMMARY_FIELDS).join(Area, Venue.area_id == Area.id),
+    [Venue.id], [int])
+
+@api.route('/venues/search')
+def api_search_venues():
+  return searchResponse(Venue)
+
+@api.route('/venues/<int:venue_id>')
+def api_venue(venue_id):
+  return detailResponse(Venue, VENUE_FIELDS, venue_id)
+
+@api.route('/artists')
+def api_artists():
+  return listResponse(ARTIST_SUMMARY_FIELDS,
+    selectFields(ARTIST_SUMMARY_FIELDS).join(Area, Artist.area_id == Area.id),
+    [Artist.id], [int])
+
+@api.route('/artists/search')
+def api_search_artists():
+  return searchResponse(Artist)
+
+@api.route('/artists/<int:artist_id>')
+def api_artist(artist_id):
+  return detailResponse(Artist, ARTIST_FIELDS, artist_id)
+
+@api.route('/shows')
+def api_shows():
+  return listResponse(SHOW_FIELDS,
+    selectFields(SHOW_FIELDS)
+      .join(Venue, Show.venue_id == Venue.id)
+      .join(Artist, Show.artist_id == Artist.id),
+    [Show.start_time, Show.id], [datetime.fromisoformat, int])
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def api_error(error):
+  return jsonResponse({'error': error.code, 'message': error.description},
+    error.code)
+
+app.register_blueprint(api)
+
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+fyyur_cli = AppGroup('fyyur', help='Maintain the Fyyur database.')
+app.cli.add_command(fyyur_cli)
+
+@fyyur_cli.command('rollover')
+def rollover_command():
+  """Uncount shows that have started since the last rollover.
+
+  Run this on a schedule, e.g. every few minutes, to keep the upcoming show
+  counts of venues and artists current.
+  """
+  rolloverShowCounts()
+
+@fyyur_cli.command('recount')
+def recount_command():
+  """Recount every venue's and artist's upcoming shows from scratch."""
+  recountShows()
+
+@fyyur_cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(BULK_MODELS)))
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', type=click.Choice(['csv', 'ndjson']),
+  help='File format, guessed from the file name if left out.')
+@click.option('--batch-size', default=1000, show_default=True,
+  help='Records inserted per transaction.')
+def import_command(kind, file, format, batch_size):
+  """Load venues, artists or shows from a CSV or NDJSON file.
+
+  Records use the field names of the venue, artist and show forms. Records
+  that can't be read are reported and skipped; a batch the database rejects
+  stops the import, keeping the batches before it.
+  """
+  format = format or guessFormat(file.name)
+  started = time.perf_counter()
+  loaded = 0
+  rejected = 0
+  explicitIds = False
+
+  for batch in batched(readRecords(file, format), batch_size):
+    records = []
+    for line, record in batch:
+      try:
+        records.append(convertRecord(kind, line, record))
+      except RecordError as e:
+        rejected += 1
+        click.echo(str(e), err=True)
+    if not records:
+      continue
+    explicitIds = explicitIds or any('id' in r for r in records)
+
+    try:
+      importBatch(kind, records)
+    except SQLAlchemyError as e:
+      raise click.ClickException('batch ending on line %d was rejected: %s'
+        % (batch[-1][0], e.orig if hasattr(e, 'orig') else e))
+
+    loaded += len(records)
+    elapsed = time.perf_counter() - started
+    click.echo('%d %s loaded, %.0f rows/s' % (loaded, kind, loaded / elapsed),
+      err=True)
+
+  if explicitIds:
+    resetIdSequence(kind)
+  elapsed = time.perf_counter() - started
+  click.echo('imported %d %s, rejected %d, in %.2fs (%.0f rows/s)'
+    % (loaded, kind, rejected, elapsed, loaded / elapsed if elapsed else 0))
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,48 @@
+"""Compares the old and current `datetime` template filter.
+
+Formats 10k show start times with each filter, the way the show and detail
+pages do, and prints the time each took. Run from the starter_code folder:
+
+    python benchmarks/bench_datetime_filter.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from app import format_datetime
+
+TIMESTAMPS = 10000
+REPEAT = 5
+
+
+def old_format_datetime(value, format='medium'):
+    # the filter as it was before formats were cached
+    date = dateutil.parser.parse(str(value))
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def main():
+    start = datetime(2020, 7, 6, 20, 0)
+    values = [start + timedelta(hours=i) for i in range(TIMESTAMPS)]
+    assert [old_format_datetime(v, 'full') for v in values[:100]] == \
+        [format_datetime(v, 'full') for v in values[:100]]
+
+    for name, filter in (('old', old_format_datetime), ('new', format_datetime)):
+        best = min(timeit.repeat(
+            lambda: [filter(v, 'full') for v in values],
+            number=1, repeat=REPEAT))
+        print('%s: %.3fs for %d timestamps (%.1f us each)'
+            % (name, best, TIMESTAMPS, best / TIMESTAMPS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
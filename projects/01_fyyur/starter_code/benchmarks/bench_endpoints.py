@@ -0,0 +1,288 @@
+"""Load-tests Fyyur's hot endpoints against a synthetic catalogue.
+
+Seeds a database with generated areas, venues, artists and shows, then
+requests the venues listing, artist pages, the shows listing and both
+searches, and reports each endpoint's p50/p95/p99 latency, requests per
+second and SQL statements per request as JSON. Run from the starter_code
+folder:
+
+    python benchmarks/bench_endpoints.py --venues 2000 --shows 50000 \\
+        --output bench.json
+
+By default the catalogue goes into a throwaway sqlite file and requests go
+through the Flask test client; pass --database-url to benchmark postgres and
+--wsgi to send real HTTP requests to a local WSGI server. Save the JSON of
+two commits and pass one as --baseline when running the other to print how
+each endpoint changed.
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+WORDS = ('Blue', 'Velvet', 'Electric', 'Golden', 'Hidden', 'Midnight',
+    'Neon', 'Silver', 'Wild', 'Lucky', 'Rusty', 'Crimson')
+PLACES = ('Hall', 'Lounge', 'Room', 'Club', 'Garden', 'Cellar', 'Stage',
+    'Tavern')
+BANDS = ('Band', 'Quartet', 'Collective', 'Trio', 'Orchestra', 'Project')
+GENRES = ('Jazz', 'Folk', 'Rock n Roll', 'Blues', 'Classical', 'Hip-Hop',
+    'Electronic', 'Soul')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--areas', type=int, default=50)
+    parser.add_argument('--venues', type=int, default=500)
+    parser.add_argument('--artists', type=int, default=500)
+    parser.add_argument('--shows', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200,
+        help='requests per endpoint (default 200)')
+    parser.add_argument('--warmup', type=int, default=20,
+        help='untimed requests per endpoint first (default 20)')
+    parser.add_argument('--random-seed', type=int, default=1)
+    parser.add_argument('--database-url',
+        help='an empty database to seed, or one seeded before with '
+        '--keep-data (default: a temporary sqlite file)')
+    parser.add_argument('--keep-data', action='store_true',
+        help="benchmark the database's existing rows instead of seeding")
+    parser.add_argument('--page-cache', action='store_true',
+        help='serve pages from the page cache (off by default, so pages '
+        'are rendered on every request)')
+    parser.add_argument('--wsgi', action='store_true',
+        help='send HTTP requests to a local WSGI server instead of using '
+        'the test client')
+    parser.add_argument('--output', help='write the JSON report here '
+        '(default: stdout)')
+    parser.add_argument('--baseline', help='a report of an earlier run to '
+        'compare against')
+    return parser.parse_args()
+
+
+def make_records(args, rng):
+    # start times are stored as naive utc
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    areas = [('City %d' % i, 'S%d' % (i % 50)) for i in range(args.areas)]
+
+    def place(i):
+        city, state = areas[i % len(areas)]
+        return {'city': city, 'state': state,
+            'genres': rng.sample(GENRES, 2), 'image_link': 'http://img/%d' % i}
+
+    venues = [dict(place(i), id=i, name='The %s %s %d' % (rng.choice(WORDS),
+        rng.choice(PLACES), i)) for i in range(1, args.venues + 1)]
+    artists = [dict(place(i), id=i, name='%s %s %d' % (rng.choice(WORDS),
+        rng.choice(BANDS), i)) for i in range(1, args.artists + 1)]
+    shows = [{'id': i, 'venue_id': rng.randint(1, args.venues),
+        'artist_id': rng.randint(1, args.artists),
+        'start_time': now + timedelta(hours=rng.randint(-24 * 180, 24 * 180))}
+        for i in range(1, args.shows + 1)]
+    return {'venues': venues, 'artists': artists, 'shows': shows}
+
+
+def seed(app_module, args, rng):
+    from importer import batched
+    records = make_records(args, rng)
+    started = time.perf_counter()
+    for kind in ('venues', 'artists', 'shows'):
+        for batch in batched(records[kind], 1000):
+            app_module.importBatch(kind, batch)
+        app_module.resetIdSequence(kind)
+    return time.perf_counter() - started
+
+
+# yields (endpoint, method, path, form) for each request of the run
+def plan_requests(args, rng, artist_ids, terms):
+    for _ in range(args.warmup + args.requests):
+        yield 'GET /venues', 'GET', '/venues', None
+        yield 'GET /artists/<id>', 'GET', \
+            '/artists/%d' % rng.choice(artist_ids), None
+        yield 'GET /shows', 'GET', '/shows', None
+        yield 'POST /venues/search', 'POST', '/venues/search', \
+            {'search_term': rng.choice(terms)}
+        yield 'POST /artists/search', 'POST', '/artists/search', \
+            {'search_term': rng.choice(terms)}
+
+
+class TestClientDriver:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form):
+        res = self.client.open(path, method=method, data=form)
+        # reading the body runs the queries of streamed pages
+        res.get_data()
+        return res.status_code
+
+    def close(self):
+        pass
+
+
+class WSGIDriver:
+    def __init__(self, app):
+        import logging
+        from werkzeug.serving import make_server
+        # don't log every request
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', 0, app)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.connection = http.client.HTTPConnection('127.0.0.1',
+            self.server.server_port)
+
+    def request(self, method, path, form):
+        body = urlencode(form) if form else None
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} \
+            if form else {}
+        self.connection.request(method, path, body, headers)
+        res = self.connection.getresponse()
+        res.read()
+        return res.status
+
+    def close(self):
+        self.connection.close()
+        self.server.shutdown()
+
+
+def percentile(sorted_values, p):
+    # nearest-rank percentile of an ascending list
+    index = max(0, math.ceil(p / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(samples):
+    latencies = sorted(latency for latency, queries in samples)
+    queries = [queries for latency, queries in samples]
+    total = sum(latencies)
+    return {
+        'requests': len(samples),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(total / len(samples) * 1000, 3),
+        'requests_per_second': round(len(samples) / total, 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'max_queries': max(queries),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(__file__), stderr=subprocess.DEVNULL,
+            text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print('%-22s %12s %12s' % ('endpoint', 'p95 change', 'rps change'),
+        file=sys.stderr)
+    for endpoint, result in report['endpoints'].items():
+        before = baseline['endpoints'].get(endpoint)
+        if before is None:
+            continue
+        print('%-22s %+11.1f%% %+11.1f%%' % (endpoint,
+            (result['p95_ms'] / before['p95_ms'] - 1) * 100,
+            (result['requests_per_second'] /
+                before['requests_per_second'] - 1) * 100), file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.random_seed)
+
+    tmp = None
+    if args.database_url is None:
+        tmp = tempfile.TemporaryDirectory()
+        args.database_url = 'sqlite:///' + os.path.join(tmp.name, 'bench.db')
+    # the app reads its database when it is imported
+    os.environ['DATABASE_URL'] = args.database_url
+    import app as app_module
+    from sqlalchemy import event
+    app, db = app_module.app, app_module.db
+    app.config['PAGE_CACHE'] = args.page_cache
+
+    with app.app_context():
+        seconds = None
+        if not args.keep_data:
+            db.create_all()
+            if db.session.query(app_module.Venue.id).first() is not None:
+                sys.exit('%s already has venues; pass --keep-data to '
+                    'benchmark them' % args.database_url)
+            seconds = seed(app_module, args, rng)
+        artist_ids = [id for id, in db.session.query(app_module.Artist.id)]
+        terms = [name.split()[1].lower() for name, in
+            db.session.query(app_module.Venue.name).limit(100)]
+        dataset = {name: db.session.query(model).count() for name, model in (
+            ('areas', app_module.Area), ('venues', app_module.Venue),
+            ('artists', app_module.Artist), ('shows', app_module.Show))}
+        dialect = db.engine.dialect.name
+        engine = db.engine
+        db.session.remove()
+
+    statements = []
+    def count(*args):
+        statements.append(1)
+    event.listen(engine, 'before_cursor_execute', count)
+
+    driver = (WSGIDriver if args.wsgi else TestClientDriver)(app)
+    samples = {}
+    seen = {}
+    try:
+        for endpoint, method, path, form in plan_requests(args, rng,
+                artist_ids, terms):
+            seen[endpoint] = seen.get(endpoint, 0) + 1
+            del statements[:]
+            started = time.perf_counter()
+            status = driver.request(method, path, form)
+            elapsed = time.perf_counter() - started
+            if status != 200:
+                sys.exit('%s %s returned %d' % (method, path, status))
+            if seen[endpoint] > args.warmup:
+                samples.setdefault(endpoint, []).append(
+                    (elapsed, len(statements)))
+    finally:
+        driver.close()
+        event.remove(engine, 'before_cursor_execute', count)
+
+    report = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'database': dialect,
+        'driver': 'wsgi' if args.wsgi else 'test-client',
+        'page_cache': args.page_cache,
+        'dataset': dataset,
+        'seed_seconds': round(seconds, 3) if seconds is not None else None,
+        'endpoints': dict((endpoint, summarize(results))
+            for endpoint, results in samples.items()),
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# small caches shared by the request handlers
+
+# a dict that holds at most maxsize entries, dropping the least recently used
+# one when it is full. entries expire ttl seconds after they are set, if a ttl
+# is given. safe to share between threads of one worker.
+class LRUCache:
+  def __init__(self, maxsize=1024, ttl=None):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.entries = OrderedDict()  # key -> (value, expiry time or None)
+    self.lock = Lock()
+
+  def get(self, key, default=None):
+    with self.lock:
+      if key not in self.entries:
+        return default
+      value, expires = self.entries[key]
+      if expires is not None and expires <= time.monotonic():
+        del self.entries[key]
+        return default
+      self.entries.move_to_end(key)
+      return value
+
+  def set(self, key, value, ttl=None):
+    ttl = ttl or self.ttl
+    expires = time.monotonic() + ttl if ttl else None
+    with self.lock:
+      self.entries[key] = (value, expires)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.maxsize:
+        self.entries.popitem(last=False)
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+  def __contains__(self, key):
+    return self.get(key, self) is not self
+
+  def __len__(self):
+    return len(self.entries)
+
+# Rendered pages are cached per path. Each path has a generation number that
+# is part of its cache keys; invalidating a path bumps the number, so every
+# cached variant of it (e.g. each page of /shows) is missed from then on and
+# ages out of the cache.
+
+# keeps pages in this worker's memory
+class MemoryPageStore:
+  def __init__(self, maxsize, ttl):
+    self.pages = LRUCache(maxsize, ttl)
+    self.generations = {}
+    self.lock = Lock()
+
+  def get(self, key):
+    return self.pages.get(key)
+
+  def set(self, key, value):
+    self.pages.set(key, value)
+
+  def generation(self, path):
+    return self.generations.get(path, 0)
+
+  def bump(self, path):
+    with self.lock:
+      self.generations[path] = self.generations.get(path, 0) + 1
+
+  def clear(self):
+    with self.lock:
+      self.pages.clear()
+      self.generations.clear()
+
+# keeps pages in a redis (or redis-compatible) server, shared by every worker
+# and by the flask commands, so they invalidate pages for all of them
+class RedisPageStore:
+  def __init__(self, url, ttl, prefix='fyyur:page:'):
+    import redis  # optional, only needed for this store
+    self.client = redis.Redis.from_url(url)
+    self.ttl = ttl
+    self.prefix = prefix
+
+  def get(self, key):
+    value = self.client.get(self.prefix + key)
+    return pickle.loads(value) if value is not None else None
+
+  def set(self, key, value):
+    self.client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+  def generation(self, path):
+    return int(self.client.get(self.prefix + 'gen:' + path) or 0)
+
+  def bump(self, path):
+    self.client.incr(self.prefix + 'gen:' + path)
+
+  def clear(self):
+    keys = list(self.client.scan_iter(self.prefix + '*'))
+    if keys:
+      self.client.delete(*keys)
+
+class PageCache:
+  def __init__(self, store):
+    self.store = store
+
+  # returns the key of a variant of the path in its current generation. take
+  # the key before rendering the page: if the path is invalidated while the
+  # page renders, the page is then stored under an old key and never served.
+  def key(self, path, variant=''):
+    return '%s#%d?%s' % (path, self.store.generation(path), variant)
+
+  # returns the cached (body, mimetype, etag) for the key, or None
+  def get(self, key):
+    return self.store.get(key)
+
+  def set(self, key, page):
+    self.store.set(key, page)
+
+  # drops every cached variant of the given paths
+  def invalidate(self, *paths):
+    for path in paths:
+      self.store.bump(path)
+
+  def clear(self):
+    self.store.clear()
+
+# returns a page cache for the config: in redis if PAGE_CACHE_URL is set,
+# otherwise in memory
+def makePageCache(config):
+  if config.get('PAGE_CACHE_URL'):
+    store = RedisPageStore(config['PAGE_CACHE_URL'], config['PAGE_CACHE_TTL'])
+  else:
+    store = MemoryPageStore(config['PAGE_CACHE_SIZE'], config['PAGE_CACHE_TTL'])
+  return PageCache(store)
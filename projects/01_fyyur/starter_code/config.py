@@ -10,7 +10,71 @@ DEBUG = True
 
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://vance@localhost:5432/fyyur'
+# DATABASE_URL overrides the local database, e.g. to point tests at sqlite
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
+  'postgresql://vance@localhost:5432/fyyur')
 
 # Disable annoying warning message
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool and statement timeout, each set from the environment.
+# Waits for a pooled connection are reported at /metrics. sqlite (e.g. in the
+# tests) doesn't pool connections, so these only apply to other databases.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+# milliseconds a statement may run before postgres cancels it, 0 for no limit
+DB_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+  from pool import TimedQueuePool
+  SQLALCHEMY_ENGINE_OPTIONS = {
+    'poolclass': TimedQueuePool,
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    'pool_recycle': DB_POOL_RECYCLE,
+  }
+  if DB_STATEMENT_TIMEOUT:
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = {
+      'options': '-c statement_timeout=%d' % DB_STATEMENT_TIMEOUT}
+
+# Statements slower than this many milliseconds are logged
+SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 200))
+
+# Number of rows listed per page. Pages are keyset-paged, so later pages
+# cost the same as the first one.
+SHOWS_PER_PAGE = 30
+VENUES_PER_PAGE = 50
+ARTISTS_PER_PAGE = 50
+SEARCH_RESULTS_PER_PAGE = 50
+
+# Records per page of the /api/v1 lists, as asked for with ?limit=, and
+# records fetched per round-trip when a list is streamed as ndjson
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_STREAM_BATCH_SIZE = 500
+
+# Search results are counted up to this many matches; past it the search
+# pages show e.g. "1000+"
+SEARCH_COUNT_LIMIT = 1000
+
+# The venues and artists pages show postgres' row estimate for tables with
+# at least this many rows, instead of counting them
+COUNT_ESTIMATE_THRESHOLD = 10000
+
+# Number of (city, state) -> area id lookups cached per worker
+AREA_CACHE_SIZE = 1024
+
+# Cache for the listing and detail pages. Pages are kept in each worker's
+# memory, or in the redis server at PAGE_CACHE_URL (e.g. redis://localhost:6379/0)
+# so all workers share them. Writes drop the pages they change; the TTL bounds
+# how long pages may lag behind shows starting and writes from other processes.
+PAGE_CACHE = True
+PAGE_CACHE_URL = os.environ.get('PAGE_CACHE_URL')
+PAGE_CACHE_SIZE = 512
+PAGE_CACHE_TTL = 60
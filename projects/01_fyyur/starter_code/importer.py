@@ -0,0 +1,111 @@
+import csv
+import json
+import dateutil.parser
+from datetime import timezone
+
+# Reading and converting the records loaded by `flask fyyur import`. Files are
+# read lazily, one record at a time, so they can be far larger than memory.
+# Records use the same field names as the venue, artist and show forms.
+
+def toList(value):
+  # csv cells hold genres as "Jazz,Folk"; ndjson records as a list
+  if isinstance(value, list):
+    return value
+  return [v.strip() for v in value.split(',') if v.strip()]
+
+def toBool(value):
+  if isinstance(value, bool):
+    return value
+  return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+def toDatetime(value):
+  # start times are stored as naive utc
+  date = dateutil.parser.parse(str(value))
+  if date.tzinfo is not None:
+    date = date.astimezone(timezone.utc).replace(tzinfo=None)
+  return date
+
+# fields each kind of record may have, and how to convert their values
+FIELDS = {
+  'venues': {
+    'id': int, 'name': str, 'city': str, 'state': str, 'address': str,
+    'phone': str, 'genres': toList, 'image_link': str, 'facebook_link': str,
+    'website': str, 'seeking_talent': toBool, 'seeking_description': str,
+  },
+  'artists': {
+    'id': int, 'name': str, 'city': str, 'state': str, 'phone': str,
+    'genres': toList, 'image_link': str, 'facebook_link': str, 'website': str,
+    'seeking_venue': toBool, 'seeking_description': str,
+  },
+  'shows': {
+    'id': int, 'artist_id': int, 'venue_id': int, 'start_time': toDatetime,
+  },
+}
+
+REQUIRED = {
+  'venues': ('name', 'city', 'state', 'genres', 'image_link'),
+  'artists': ('name', 'city', 'state', 'genres', 'image_link'),
+  'shows': ('artist_id', 'venue_id', 'start_time'),
+}
+
+class RecordError(ValueError):
+  def __init__(self, line, message):
+    super().__init__('line %d: %s' % (line, message))
+    self.line = line
+
+# guesses csv or ndjson from a file name
+def guessFormat(filename):
+  if filename.lower().endswith('.csv'):
+    return 'csv'
+  return 'ndjson'
+
+# yields (line number, raw dict) for each record of an open text file
+def readRecords(file, format):
+  if format == 'csv':
+    reader = csv.DictReader(file)
+    for record in reader:
+      yield reader.line_num, record
+  else:
+    for line, text in enumerate(file, 1):
+      if text.strip():
+        try:
+          yield line, json.loads(text)
+        except ValueError as e:
+          yield line, RecordError(line, 'invalid json: %s' % e)
+
+# returns the record with its values converted for the given kind, or raises
+# RecordError naming the line if it can't be
+def convertRecord(kind, line, record):
+  if isinstance(record, RecordError):
+    raise record
+  if not isinstance(record, dict):
+    raise RecordError(line, 'expected an object')
+
+  fields = FIELDS[kind]
+  result = {}
+  for key, value in record.items():
+    if key not in fields:
+      raise RecordError(line, 'unknown field %r' % key)
+    # empty csv cells are missing values
+    if value is None or value == '':
+      continue
+    try:
+      result[key] = fields[key](value)
+    except (TypeError, ValueError, OverflowError):
+      raise RecordError(line, 'invalid %s %r' % (key, value))
+
+  for key in REQUIRED[kind]:
+    if not result.get(key):
+      raise RecordError(line, 'missing %s' % key)
+  return result
+
+# yields lists of up to size items
+def batched(items, size):
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
@@ -0,0 +1,45 @@
+"""index foreign keys, show times and lowercased names
+
+Revision ID: 5b8c3d1e6f20
+Revises: a41f0c6e2d87
+Create Date: 2026-10-18 15:21:38.904122
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8c3d1e6f20'
+down_revision = 'a41f0c6e2d87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # past/upcoming shows of a venue or artist filter on its id and the time
+    op.create_index('ix_shows_venue_id_start_time', 'shows',
+        ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows',
+        ['artist_id', 'start_time'], unique=False)
+    # the shows page and the counter rollover walk shows in time order
+    op.create_index('ix_shows_start_time_id', 'shows',
+        ['start_time', 'id'], unique=False)
+    op.create_index(op.f('ix_venues_area_id'), 'venues', ['area_id'],
+        unique=False)
+    op.create_index(op.f('ix_artists_area_id'), 'artists', ['area_id'],
+        unique=False)
+    op.create_index('ix_venues_lower_name', 'venues',
+        [sa.text('lower(name)')], unique=False)
+    op.create_index('ix_artists_lower_name', 'artists',
+        [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_lower_name', table_name='artists')
+    op.drop_index('ix_venues_lower_name', table_name='venues')
+    op.drop_index(op.f('ix_artists_area_id'), table_name='artists')
+    op.drop_index(op.f('ix_venues_area_id'), table_name='venues')
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
@@ -0,0 +1,38 @@
+"""make areas unique by city and state
+
+Revision ID: 7d2e4f8a9b13
+Revises: 3c1a7e9b5d42
+Create Date: 2026-10-18 11:47:05.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4f8a9b13'
+down_revision = '3c1a7e9b5d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # point venues and artists in duplicate areas at the oldest copy,
+    # then drop the duplicates so the constraint can be added
+    for table in ('venues', 'artists'):
+        op.execute('''
+            UPDATE {} SET area_id = d.keep
+            FROM (SELECT id, min(id) OVER (PARTITION BY city, state) AS keep
+                  FROM areas) AS d
+            WHERE area_id = d.id AND d.id <> d.keep
+        '''.format(table))
+    op.execute('''
+        DELETE FROM areas a USING areas b
+        WHERE a.city = b.city AND a.state = b.state AND a.id > b.id
+    ''')
+    op.create_unique_constraint('uq_areas_city_state', 'areas',
+        ['city', 'state'])
+
+
+def downgrade():
+    op.drop_constraint('uq_areas_city_state', 'areas', type_='unique')
@@ -0,0 +1,48 @@
+"""keep counts of upcoming shows on venues and artists
+
+Revision ID: a41f0c6e2d87
+Revises: 7d2e4f8a9b13
+Create Date: 2026-10-18 13:02:56.730918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41f0c6e2d87'
+down_revision = '7d2e4f8a9b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('num_upcoming_shows', sa.Integer(),
+        server_default='0', nullable=False))
+    op.add_column('artists', sa.Column('num_upcoming_shows', sa.Integer(),
+        server_default='0', nullable=False))
+    op.create_table('show_counter',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # count the shows that are upcoming right now, in utc like the app does
+    op.execute('''
+        INSERT INTO show_counter (id, rolled_until)
+        VALUES (1, now() AT TIME ZONE 'utc')
+    ''')
+    for table, column in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.execute('''
+            UPDATE {0} SET num_upcoming_shows = (
+                SELECT count(*) FROM shows
+                WHERE shows.{1} = {0}.id
+                  AND shows.start_time > (SELECT rolled_until FROM show_counter)
+            )
+        '''.format(table, column))
+
+
+def downgrade():
+    op.drop_table('show_counter')
+    op.drop_column('artists', 'num_upcoming_shows')
+    op.drop_column('venues', 'num_upcoming_shows')
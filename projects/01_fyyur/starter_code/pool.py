@@ -0,0 +1,72 @@
+import time
+from threading import Lock
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# The database connection pool, keeping statistics about its checkouts for
+# the /metrics endpoint: how many there were, how long requests waited for a
+# connection, and how far the pool overflowed its size.
+
+class PoolStats:
+  def __init__(self):
+    self.lock = Lock()
+    self.checkouts = 0
+    self.waitSeconds = 0.0
+    self.maxWaitSeconds = 0.0
+    self.timeouts = 0
+    self.maxOverflow = 0
+
+  def record(self, waited, timedOut, overflow):
+    with self.lock:
+      self.checkouts += 1
+      self.waitSeconds += waited
+      self.maxWaitSeconds = max(self.maxWaitSeconds, waited)
+      self.timeouts += timedOut
+      self.maxOverflow = max(self.maxOverflow, overflow)
+
+# a QueuePool timing how long each checkout waits for a connection
+class TimedQueuePool(QueuePool):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.stats = PoolStats()
+
+  def _do_get(self):
+    started = time.perf_counter()
+    timedOut = False
+    try:
+      return super()._do_get()
+    except exc.TimeoutError:
+      timedOut = True
+      raise
+    finally:
+      self.stats.record(time.perf_counter() - started, timedOut,
+        max(0, self.overflow()))
+
+  # keeps the statistics when the pool is replaced, e.g. by engine.dispose()
+  def recreate(self):
+    pool = super().recreate()
+    pool.stats = self.stats
+    return pool
+
+# returns (name, value) pairs describing the pool, in the prometheus text
+# format's naming. pools that don't queue connections (e.g. sqlite's) have
+# nothing to report.
+def poolMetrics(pool, prefix='db_pool_'):
+  if not isinstance(pool, QueuePool):
+    return []
+  metrics = [
+    ('size', pool.size()),
+    ('checked_out', pool.checkedout()),
+    ('overflow', max(0, pool.overflow())),
+  ]
+  stats = getattr(pool, 'stats', None)
+  if stats is not None:
+    with stats.lock:
+      metrics += [
+        ('checkouts_total', stats.checkouts),
+        ('checkout_wait_seconds_total', round(stats.waitSeconds, 6)),
+        ('checkout_wait_seconds_max', round(stats.maxWaitSeconds, 6)),
+        ('checkout_timeouts_total', stats.timeouts),
+        ('overflow_max', stats.maxOverflow),
+      ]
+  return [(prefix + name, value) for name, value in metrics]
@@ -0,0 +1,89 @@
+import re
+
+# In-process stand-in for the pg_trgm name search, used when the database is
+# not postgres (e.g. sqlite in the tests). It ranks names the way pg_trgm's
+# similarity() does and matches the same case-insensitive substrings as ILIKE.
+
+# pg_trgm's default similarity threshold for the % operator
+SIMILARITY_THRESHOLD = 0.3
+
+def wordTrigrams(text):
+  # trigrams the way pg_trgm builds them: lowercased words made of letters
+  # and digits, each padded with two spaces in front and one behind
+  result = set()
+  for word in re.findall(r'[^\W_]+', text.lower()):
+    padded = '  ' + word + ' '
+    for i in range(len(padded) - 2):
+      result.add(padded[i:i + 3])
+  return result
+
+def substringTrigrams(text):
+  # every run of three characters in the text, used to narrow down the names
+  # that can contain it as a substring
+  text = text.lower()
+  return set(text[i:i + 3] for i in range(len(text) - 2))
+
+def similarity(a, b):
+  if not a or not b:
+    return 0.0
+  return len(a & b) / len(a | b)
+
+class TrigramIndex:
+  def __init__(self, rows=()):
+    self.names = {}     # id -> lowercased name
+    self.trigrams = {}  # id -> word trigrams of the name
+    self.words = {}     # word trigram -> ids
+    self.chars = {}     # substring trigram -> ids
+    for id, name in rows:
+      self.add(id, name)
+
+  def add(self, id, name):
+    self.discard(id)
+    self.names[id] = name.lower()
+    self.trigrams[id] = wordTrigrams(name)
+    for t in self.trigrams[id]:
+      self.words.setdefault(t, set()).add(id)
+    for t in substringTrigrams(name):
+      self.chars.setdefault(t, set()).add(id)
+
+  def discard(self, id):
+    name = self.names.pop(id, None)
+    if name is None:
+      return
+    for t in self.trigrams.pop(id):
+      self.words[t].discard(id)
+    for t in substringTrigrams(name):
+      self.chars[t].discard(id)
+
+  # returns up to limit (id, score) pairs for names containing term or
+  # similar enough to it, best matches first. matches are ordered by
+  # (-score, lowercased name, id); with after, only those sorting after that
+  # key are returned.
+  def search(self, term, limit, after=None):
+    term = term.lower()
+    queryTrigrams = wordTrigrams(term)
+
+    # names sharing a trigram with the term may be similar enough
+    candidates = set()
+    for t in queryTrigrams:
+      candidates |= self.words.get(t, set())
+
+    # names containing the term must contain every trigram of it
+    inner = substringTrigrams(term)
+    if inner:
+      contains = set.intersection(*(self.chars.get(t, set()) for t in inner))
+    else:
+      # terms under three characters have no trigrams to narrow things down
+      contains = set(self.names)
+    contains = set(id for id in contains if term in self.names[id])
+
+    scored = []
+    for id in candidates | contains:
+      score = similarity(queryTrigrams, self.trigrams[id])
+      if id in contains or score >= SIMILARITY_THRESHOLD:
+        scored.append((-score, self.names[id], id))
+    if after is not None:
+      after = tuple(after)
+      scored = [key for key in scored if key > after]
+    scored.sort()
+    return [(id, -score) for score, name, id in scored[:limit]]
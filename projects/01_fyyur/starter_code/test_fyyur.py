@@ -0,0 +1,890 @@
+import os
+import re
+import json
+import tempfile
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+import sqlstats
+from flask.testing import FlaskClient
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, InvalidRequestError, \
+    SQLAlchemyError
+from sqlalchemy.orm import Session
+
+# point the app at a throwaway database before it reads config.py
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app import app, db, Area, Venue, Artist, Show, searchIndexes, areaIds, \
+    pageCache
+
+
+class BufferedClient(FlaskClient):
+    """Reads streamed pages in full before returning, which ends their
+    request context like any other request's."""
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return super().open(*args, **kwargs)
+
+
+class FyyurTestCase(unittest.TestCase):
+    """This class represents the fyyur test case"""
+
+    def setUp(self):
+        """Define test variables and initialize app."""
+        app.config['TESTING'] = True
+        app.test_client_class = BufferedClient
+        self.client = app.test_client
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        # tables are recreated per test, so indexes of old rows are stale
+        searchIndexes.clear()
+        areaIds.clear()
+        pageCache.clear()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    @contextmanager
+    def captureQueries(self):
+        """Collects the statement and parameters of each query in the block."""
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                context, executemany):
+            if not executemany:
+                queries.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                before_cursor_execute)
+
+    def explain(self, statement, parameters):
+        """Returns the lines of the query plan of the statement."""
+        connection = db.session.connection()
+        if db.engine.dialect.name == 'postgresql':
+            # tables this small would be scanned anyway; with sequential
+            # scans off, the plan only has one where no index fits
+            connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+            rows = connection.exec_driver_sql('EXPLAIN ' + statement,
+                parameters)
+            return [row[0] for row in rows]
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+            parameters)
+        return [row[-1] for row in rows]
+
+    def fullScans(self, plan):
+        """Returns the steps of a query plan that read a whole table or index."""
+        tables = r'(shows|venues|artists|areas)\b'
+        if db.engine.dialect.name == 'postgresql':
+            # scan nodes without an index condition read everything
+            nodes = []
+            for line in plan:
+                if re.search(r'Scan .*on %s' % tables, line):
+                    nodes.append([line, False])
+                elif re.search(r'(Index|Recheck) Cond:', line) and nodes:
+                    nodes[-1][1] = True
+            return [line for line, bounded in nodes if not bounded]
+        # sqlite SCANs a table or index from end to end, and SEARCHes a range
+        return [line for line in plan if re.match(r'SCAN %s' % tables, line)]
+
+    @contextmanager
+    def countRows(self):
+        """Collects the number of rows each ORM query in the block fetched."""
+        rows = []
+
+        def do_orm_execute(state):
+            result = state.invoke_statement().freeze()
+            rows.append(len(result.data))
+            return result()
+
+        event.listen(Session, 'do_orm_execute', do_orm_execute)
+        try:
+            yield rows
+        finally:
+            event.remove(Session, 'do_orm_execute', do_orm_execute)
+
+    def seed(self, areas=2, venues=3, shows=2):
+        """Adds areas, each with venues holding past and upcoming shows."""
+        now = datetime.now()
+        artist = None
+        for a in range(areas):
+            area = Area(city='City %d' % a, state='S%d' % a)
+            db.session.add(area)
+            db.session.flush()
+            if artist is None:
+                artist = Artist(name='Artist', area_id=area.id,
+                    genres=['Jazz'], image_link='http://img/artist')
+                db.session.add(artist)
+                db.session.flush()
+            for v in range(venues):
+                venue = Venue(name='Venue %d-%d' % (a, v), area_id=area.id,
+                    genres=['Jazz'], image_link='http://img/venue')
+                db.session.add(venue)
+                db.session.flush()
+                for s in range(shows):
+                    db.session.add(Show(artist_id=artist.id, venue_id=venue.id,
+                        start_time=now + timedelta(days=s + 1)))
+                db.session.add(Show(artist_id=artist.id, venue_id=venue.id,
+                    start_time=now - timedelta(days=1)))
+        # an area with no venues should not be listed
+        db.session.add(Area(city='Empty', state='ZZ'))
+        db.session.commit()
+
+    def test_venues_groups_by_area(self):
+        self.seed(areas=2, venues=2, shows=3)
+        res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+        body = res.get_data(as_text=True)
+        self.assertIn('City 0, S0', body)
+        self.assertIn('Venue 1-1', body)
+        self.assertNotIn('Empty, ZZ', body)
+
+    def test_venues_upcoming_counts(self):
+        from app import getVenuesByArea
+        self.seed(areas=2, venues=2, shows=3)
+
+        data, nextPage = getVenuesByArea()
+        self.assertIsNone(nextPage)
+        self.assertEqual([a['city'] for a in data], ['City 0', 'City 1'])
+        for area in data:
+            self.assertEqual(len(area['venues']), 2)
+            for venue in area['venues']:
+                self.assertEqual(venue['num_upcoming_shows'], 3)
+
+    def test_venues_query_budget(self):
+        self.seed(areas=5, venues=10, shows=2)
+        # the page must not issue a query per area or per venue; one query
+        # lists them and one counts them
+        with sqlstats.query_budget(3):
+            res = self.client().get('/venues')
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_shows_keyset_pages(self):
+        from app import getShowsPage, decodeCursor
+        self.seed(areas=1, venues=5, shows=4)
+
+        seen = []
+        page, nextPage = getShowsPage(limit=7)
+        while True:
+            seen.extend(page)
+            if nextPage is None:
+                break
+            res = self.client().get('/shows', query_string={'after': nextPage})
+            self.assertEqual(res.status_code, 200)
+            page, nextPage = getShowsPage(
+                decodeCursor(nextPage, datetime.fromisoformat, int), limit=7)
+
+        self.assertEqual(len(seen), Show.query.count())
+        self.assertEqual(len(set(s['id'] for s in seen)), len(seen))
+        keys = [(s['start_time'], s['id']) for s in seen]
+        self.assertEqual(keys, sorted(keys))
+
+    def test_shows_bad_cursor(self):
+        from app import encodeCursor
+        for cursor in ('yesterday', encodeCursor(['yesterday', 1]),
+                encodeCursor([1])):
+            res = self.client().get('/shows', query_string={'after': cursor})
+            self.assertEqual(res.status_code, 400, cursor)
+
+    def pageThrough(self, url, method='get', **data):
+        """Follows the next-page cursors of a listing, returning every page."""
+        pages = []
+        after = None
+        while True:
+            fields = dict(data, after=after) if after else data
+            if method == 'get':
+                res = self.client().get(url, query_string=fields)
+            else:
+                res = self.client().post(url, data=fields)
+            self.assertEqual(res.status_code, 200)
+            pages.append(res.get_data(as_text=True))
+            match = re.search(r'name="after" value="([^"]+)"|after=([^"&]+)"',
+                pages[-1])
+            if match is None:
+                return pages
+            after = match.group(1) or match.group(2)
+
+    def test_listings_page_through_every_row(self):
+        self.seed(areas=3, venues=4, shows=1)
+        for i in range(5):
+            db.session.add(Artist(name='artist %d' % i, area_id=1,
+                genres=['Jazz'], image_link='http://img/artist'))
+        db.session.commit()
+
+        with mock.patch.dict(app.config, VENUES_PER_PAGE=5,
+                ARTISTS_PER_PAGE=2, SEARCH_RESULTS_PER_PAGE=5):
+            venuePages = self.pageThrough('/venues')
+            artistPages = self.pageThrough('/artists')
+            searchPages = self.pageThrough('/venues/search', 'post',
+                search_term='venue')
+
+        self.assertEqual(len(venuePages), 3)
+        self.assertEqual(len(artistPages), 3)
+        self.assertEqual(len(searchPages), 3)
+        self.assertIn('12 venues', venuePages[0])
+        self.assertIn('6 artists', artistPages[-1])
+        self.assertIn('First page', venuePages[-1])
+        self.assertIn(': 12</h3>', searchPages[0])
+        for pages in (venuePages, searchPages):
+            names = re.findall(r'<h5>(Venue [\d-]+)</h5>', ''.join(pages))
+            self.assertEqual(sorted(names), sorted(v.name for v in Venue.query))
+        names = re.findall(r'<h5>([Aa]rtist[ \d]*)</h5>', ''.join(artistPages))
+        self.assertEqual(names, ['Artist'] + ['artist %d' % i for i in range(5)])
+
+    def test_search_count_is_capped(self):
+        self.seed(areas=2, venues=4, shows=1)
+        with mock.patch.dict(app.config, SEARCH_RESULTS_PER_PAGE=2,
+                SEARCH_COUNT_LIMIT=5):
+            res = self.client().post('/venues/search',
+                data={'search_term': 'venue'})
+        self.assertIn(': 5+</h3>', res.get_data(as_text=True))
+
+    def test_row_estimate_binds_table(self):
+        from sqlalchemy.dialects import postgresql
+        from app import ESTIMATE_ROWS
+        compiled = ESTIMATE_ROWS.compile(dialect=postgresql.psycopg2.dialect())
+        self.assertIn('CAST(%(table)s AS regclass)', str(compiled))
+        self.assertEqual(list(compiled.binds), ['table'])
+
+    def test_get_shows_splits_at_now(self):
+        from app import getShows
+        self.seed(areas=1, venues=2, shows=3)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+
+        past, upcoming = getShows(venue)
+        self.assertEqual((len(past), len(upcoming)), (1, 3))
+        self.assertEqual(upcoming[0]['artist_name'], 'Artist')
+        times = [s['start_time'] for s in past + upcoming]
+        self.assertEqual(times, sorted(times))
+
+        past, upcoming = getShows(artist)
+        self.assertEqual((len(past), len(upcoming)), (2, 6))
+        self.assertIn('venue_image_link', upcoming[0])
+
+    def test_detail_pages_query_budget(self):
+        self.seed(areas=1, venues=2, shows=3)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+        db.session.remove()
+
+        for url in ('/venues/%d' % venue.id, '/artists/%d' % artist.id):
+            # entity, area and a single query for all of its shows
+            with sqlstats.query_budget(3):
+                res = self.client().get(url)
+            self.assertEqual(res.status_code, 200)
+
+    def test_rows_fetched_per_endpoint(self):
+        self.seed(areas=2, venues=3, shows=4)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+        db.session.remove()
+        venueCount = Venue.query.count()
+        showCount = Show.query.count()
+
+        # rows each endpoint may fetch; shows are only read on the pages that
+        # list them, never dragged along with the venues, artists or areas
+        budgets = {
+            '/venues': venueCount + 1,
+            '/artists': 1 + 1,
+            '/shows': showCount,
+            '/venues/%d' % venue.id: 1 + 5,
+            '/artists/%d' % artist.id: 1 + showCount,
+            '/venues/%d/edit' % venue.id: 1,
+            '/artists/%d/edit' % artist.id: 1,
+        }
+        for url, budget in budgets.items():
+            with self.countRows() as rows:
+                res = self.client().get(url)
+            self.assertEqual(res.status_code, 200, url)
+            self.assertLessEqual(sum(rows), budget, url)
+
+    def test_relationships_do_not_lazy_load(self):
+        self.seed(areas=1, venues=1, shows=1)
+        db.session.remove()
+        for model, name in ((Venue, 'shows'), (Artist, 'shows'),
+                (Area, 'venues'), (Area, 'artists')):
+            with self.subTest(model=model.__name__, relationship=name):
+                row = model.query.first()
+                with self.assertRaises(InvalidRequestError):
+                    getattr(row, name)
+
+    def test_delete_venue_cascades_to_shows(self):
+        self.seed(areas=1, venues=2, shows=2)
+        venueId = Venue.query.first().id
+        db.session.remove()
+
+        res = self.client().delete('/venues/%d' % venueId)
+        self.assertEqual(res.get_json(), {'success': True, 'deleted': venueId})
+        self.assertIsNone(Venue.query.get(venueId))
+        self.assertEqual(Show.query.filter_by(venue_id=venueId).count(), 0)
+        self.assertEqual(self.client().delete('/venues/%d' % venueId)
+            .status_code, 404)
+
+    def test_write_commits_once(self):
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(Session, 'after_commit', listener)
+        try:
+            self.client().post('/venues/create', data=self.venueForm('First'))
+        finally:
+            event.remove(Session, 'after_commit', listener)
+        # the new area and the venue are committed together
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(Venue.query.one().area.city, 'San Francisco')
+
+    def test_failed_write_keeps_nothing(self):
+        client = self.client()
+        form = self.venueForm('First', city='Nowhere')
+        del form['image_link']
+        res = client.post('/venues/create', data=form)
+        # the venue violates NOT NULL, so the area written for it is
+        # rolled back with it and the database's reason is flashed
+        self.assertEqual(Area.query.count(), 0)
+        self.assertIn('Venue First was not listed: NOT NULL',
+            res.get_data(as_text=True))
+
+    def test_units_of_work_nest(self):
+        from app import unitOfWork
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(Session, 'after_commit', listener)
+        try:
+            with unitOfWork():
+                with unitOfWork():
+                    db.session.add(Area(city='Austin', state='TX'))
+                db.session.add(Area(city='Dallas', state='TX'))
+            with self.assertRaises(IntegrityError):
+                with unitOfWork():
+                    db.session.add(Area(city='Houston', state='TX'))
+                    with unitOfWork():
+                        db.session.add(Area(city='Austin', state='TX'))
+        finally:
+            event.remove(Session, 'after_commit', listener)
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(sorted(a.city for a in Area.query),
+            ['Austin', 'Dallas'])
+
+    def test_search_venues(self):
+        self.seed(areas=1, venues=1, shows=2)
+        area = Area.query.first()
+        for name in ('The Musical Hop', 'Park Square Live Music & Coffee',
+                'The Dueling Pianos Bar'):
+            db.session.add(Venue(name=name, area_id=area.id, genres=['Jazz'],
+                image_link='http://img/venue'))
+        db.session.commit()
+
+        res = self.client().post('/venues/search', data={'search_term': 'Music'})
+        body = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('The Musical Hop', body)
+        self.assertIn('Park Square Live Music &amp; Coffee', body)
+        self.assertNotIn('Pianos', body)
+
+        res = self.client().post('/venues/search', data={'search_term': 'hop'})
+        self.assertIn('The Musical Hop', res.get_data(as_text=True))
+
+    def test_search_ranks_and_counts_in_one_query(self):
+        from app import searchByName
+        self.seed(areas=1, venues=3, shows=2)
+        searchByName(Venue, 'warm up', 10)
+
+        with sqlstats.collect_statements() as statements:
+            results, nextPage = searchByName(Venue, 'venue 0-1', 10)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(results[0]['name'], 'Venue 0-1')
+        self.assertEqual(results[0]['num_upcoming_shows'], 2)
+
+        results, nextPage = searchByName(Venue, 'venue', 2)
+        self.assertEqual(len(results), 2)
+        self.assertIsNotNone(nextPage)
+
+    def test_search_index_follows_writes(self):
+        from app import searchByName
+        self.seed(areas=1, venues=1, shows=1)
+        self.assertEqual(searchByName(Artist, 'band', 10), ([], None))
+
+        artist = Artist.query.first()
+        artist.name = 'The Wild Sax Band'
+        db.session.commit()
+        self.assertEqual(searchByName(Artist, 'band', 10)[0][0]['id'],
+            artist.id)
+        # misspellings still match through trigram similarity
+        self.assertEqual(searchByName(Artist, 'wild sax bnd', 10)[0][0]['id'],
+            artist.id)
+
+    def test_search_wildcards_match_literally(self):
+        from search import TrigramIndex
+        index = TrigramIndex([(1, '100% Jazz'), (2, 'Jazz Bar')])
+        self.assertEqual([id for id, score in index.search('0%', 10)], [1])
+        self.assertEqual([id for id, score in index.search('a_', 10)], [])
+
+    def venueForm(self, name, city='San Francisco', state='CA'):
+        return {'name': name, 'city': city, 'state': state,
+            'genres': ['Jazz'], 'image_link': 'http://img/venue'}
+
+    def test_create_venues_share_area(self):
+        for name in ('First', 'Second'):
+            res = self.client().post('/venues/create', data=self.venueForm(name))
+            self.assertEqual(res.status_code, 200)
+        self.client().post('/venues/create',
+            data=self.venueForm('Third', city='Oakland'))
+
+        self.assertEqual(Area.query.count(), 2)
+        first = Venue.query.filter_by(name='First').one()
+        second = Venue.query.filter_by(name='Second').one()
+        self.assertEqual(first.area_id, second.area_id)
+
+    def test_area_id_cached_after_commit(self):
+        from app import getAreaId
+        areaId = getAreaId('Austin', 'TX')
+        self.assertNotIn(('Austin', 'TX'), areaIds)
+        db.session.commit()
+        self.assertEqual(areaIds.get(('Austin', 'TX')), areaId)
+
+        with sqlstats.collect_statements() as statements:
+            self.assertEqual(getAreaId('Austin', 'TX'), areaId)
+        self.assertEqual(statements, [])
+
+    def test_area_id_not_cached_after_rollback(self):
+        from app import getAreaId
+        getAreaId('Austin', 'TX')
+        db.session.rollback()
+
+        self.assertNotIn(('Austin', 'TX'), areaIds)
+        self.assertEqual(Area.query.count(), 0)
+
+    def test_area_city_state_unique(self):
+        db.session.add(Area(city='Austin', state='TX'))
+        db.session.commit()
+        db.session.add(Area(city='Austin', state='TX'))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_new_show_counted(self):
+        self.seed(areas=1, venues=1, shows=0)
+        venueId = Venue.query.first().id
+        artistId = Artist.query.first().id
+        form = {'venue_id': venueId, 'artist_id': artistId}
+
+        later = datetime.now() + timedelta(days=3)
+        self.client().post('/shows/create',
+            data=dict(form, start_time=later.strftime('%Y-%m-%d %H:%M:%S')))
+        earlier = datetime.now() - timedelta(days=3)
+        self.client().post('/shows/create',
+            data=dict(form, start_time=earlier.strftime('%Y-%m-%d %H:%M:%S')))
+
+        self.assertEqual(Venue.query.get(venueId).num_upcoming_shows, 1)
+        self.assertEqual(Artist.query.get(artistId).num_upcoming_shows, 1)
+
+    def test_new_show_with_offset_stored_as_utc(self):
+        self.seed(areas=1, venues=1, shows=0)
+        venueId = Venue.query.first().id
+        res = self.client().post('/shows/create', data={'venue_id': venueId,
+            'artist_id': Artist.query.first().id,
+            'start_time': '2030-01-01T20:00:00+02:00'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Show.query.order_by(Show.start_time.desc())
+            .first().start_time, datetime(2030, 1, 1, 18))
+        self.assertEqual(Venue.query.get(venueId).num_upcoming_shows, 1)
+
+    def test_deleted_venue_uncounted_from_artist(self):
+        self.seed(areas=1, venues=2, shows=2)
+        artist = Artist.query.first()
+        self.assertEqual(artist.num_upcoming_shows, 4)
+
+        venue = Venue.query.options(db.selectinload(Venue.shows)).first()
+        db.session.delete(venue)
+        db.session.commit()
+        self.assertEqual(Artist.query.get(artist.id).num_upcoming_shows, 2)
+
+    def test_rollover_uncounts_started_shows(self):
+        from app import getNow, rolloverShowCounts
+        self.seed(areas=1, venues=1, shows=3)
+        venue = Venue.query.first()
+        db.session.add(Show(venue_id=venue.id, artist_id=Artist.query.first().id,
+            start_time=getNow() + timedelta(hours=1)))
+        db.session.commit()
+        self.assertEqual(venue.num_upcoming_shows, 4)
+
+        # two hours later, only the show an hour away has started
+        with mock.patch('app.getNow', return_value=getNow() + timedelta(hours=2)):
+            rolloverShowCounts()
+            rolloverShowCounts()
+        self.assertEqual(Venue.query.get(venue.id).num_upcoming_shows, 3)
+        self.assertEqual(Artist.query.first().num_upcoming_shows, 3)
+
+    def test_rollover_starts_counter_without_share_lock(self):
+        from app import ShowCounter, getNow, rolloverShowCounts
+        # a share lock taken before the update lock deadlocks two runs
+        with mock.patch('app.getRolledUntil', side_effect=AssertionError):
+            rolloverShowCounts()
+            rolloverShowCounts()
+        self.assertEqual(ShowCounter.query.count(), 1)
+        self.assertLessEqual(ShowCounter.query.one().rolled_until, getNow())
+
+    def test_recount_matches_shows(self):
+        from app import recountShows, getShows
+        self.seed(areas=2, venues=2, shows=2)
+        Venue.query.update({'num_upcoming_shows': 99})
+        db.session.commit()
+
+        recountShows()
+        for venue in Venue.query.all():
+            self.assertEqual(venue.num_upcoming_shows, len(getShows(venue)[1]))
+
+    def runImport(self, kind, text, suffix, *args):
+        path = os.path.join(self.tmp.name, kind + suffix)
+        with open(path, 'w') as f:
+            f.write(text)
+        return app.test_cli_runner().invoke(
+            args=['fyyur', 'import', kind, path] + list(args))
+
+    def test_import_catalogue(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+        venues = 'id,name,city,state,genres,image_link,seeking_talent\n'
+        for i in range(1, 8):
+            venues += '%d,Venue %d,City %d,CA,"Jazz,Folk",http://img,yes\n' \
+                % (i, i, i % 3)
+        venues += ',,Nowhere,CA,Jazz,http://img,no\n'
+        res = self.runImport('venues', venues, '.csv', '--batch-size', '3')
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertIn('imported 7 venues, rejected 1', res.output)
+        self.assertEqual(Area.query.count(), 3)
+        self.assertEqual(Venue.query.get(2).genres, ['Jazz', 'Folk'])
+        self.assertTrue(Venue.query.get(2).seeking_talent)
+
+        res = self.runImport('artists', json.dumps({'name': 'Band',
+            'city': 'City 1', 'state': 'CA', 'genres': ['Rock'],
+            'image_link': 'http://img'}) + '\n', '.ndjson')
+        self.assertEqual(res.exit_code, 0, res.output)
+        artist = Artist.query.one()
+
+        later = datetime.now() + timedelta(days=2)
+        earlier = datetime.now() - timedelta(days=2)
+        shows = ''.join(json.dumps({'venue_id': v, 'artist_id': artist.id,
+            'start_time': t.isoformat()}) + '\n'
+            for v in range(1, 8) for t in (later, earlier))
+        res = self.runImport('shows', shows, '.ndjson', '--batch-size', '4')
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertEqual(Show.query.count(), 14)
+
+        db.session.expire_all()
+        self.assertEqual(Artist.query.get(artist.id).num_upcoming_shows, 7)
+        self.assertEqual(Venue.query.get(5).num_upcoming_shows, 1)
+        from app import searchByName
+        self.assertEqual(searchByName(Venue, 'venue 4', 1)[0][0]['id'], 4)
+
+    def test_import_rejected_batch(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+        venue = json.dumps({'id': 1, 'name': 'Venue', 'city': 'City',
+            'state': 'CA', 'genres': ['Jazz'], 'image_link': 'http://img'})
+        res = self.runImport('venues', venue + '\n' + venue + '\n',
+            '.ndjson', '--batch-size', '1')
+        self.assertNotEqual(res.exit_code, 0)
+        self.assertIn('line 2 was rejected', res.output)
+        # the batch before the rejected one is kept
+        self.assertEqual(Venue.query.count(), 1)
+
+    def test_datetime_filter(self):
+        from app import format_datetime
+        import babel.dates
+        value = datetime(2035, 4, 1, 20, 30)
+        for format, pattern in (('full', "EEEE MMMM, d, y 'at' h:mma"),
+                ('medium', 'EE MM, dd, y h:mma'), ('y-MM-dd', 'y-MM-dd'),
+                ('short', 'short'), ('long', 'long')):
+            expected = babel.dates.format_datetime(value, pattern, locale='en')
+            self.assertEqual(format_datetime(value, format), expected)
+            self.assertEqual(format_datetime(str(value), format), expected)
+        self.assertEqual(format_datetime(value, 'full'),
+            'Sunday April, 1, 2035 at 8:30PM')
+        self.assertTrue(format_datetime(value, 'short').startswith('4/1/35, '))
+
+    def test_api_lists_page_and_stream(self):
+        self.seed(areas=2, venues=3, shows=2)
+        client = self.client()
+
+        seen = []
+        res = client.get('/api/v1/venues?limit=4')
+        while True:
+            self.assertEqual(res.content_type, 'application/json')
+            page = res.get_json()
+            seen.extend(page['data'])
+            if page['next'] is None:
+                break
+            res = client.get('/api/v1/venues',
+                query_string={'limit': 4, 'after': page['next']})
+        self.assertEqual([v['id'] for v in seen],
+            sorted(v.id for v in Venue.query))
+        self.assertEqual(seen[0]['city'], 'City 0')
+
+        res = client.get('/api/v1/shows',
+            headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        shows = [json.loads(line) for line in res.get_data(as_text=True)
+            .splitlines()]
+        self.assertEqual(len(shows), Show.query.count())
+        self.assertEqual(sorted(s['start_time'] for s in shows),
+            [s['start_time'] for s in shows])
+        datetime.fromisoformat(shows[0]['start_time'])
+
+        self.assertEqual(client.get('/api/v1/artists?limit=0').status_code,
+            400)
+
+    def test_api_detail_reads_rows_not_objects(self):
+        self.seed(areas=1, venues=2, shows=2)
+        venue = Venue.query.first()
+        venueId = venue.id
+        db.session.remove()
+
+        loaded = []
+        def load(target, context):
+            loaded.append(target)
+        for model in (Venue, Artist, Show, Area):
+            event.listen(model, 'load', load)
+        try:
+            data = self.client().get('/api/v1/venues/%d' % venueId).get_json()
+            results = self.client().get('/api/v1/venues/search?q=venue')
+        finally:
+            for model in (Venue, Artist, Show, Area):
+                event.remove(model, 'load', load)
+
+        self.assertEqual(loaded, [])
+        self.assertEqual(data['id'], venueId)
+        self.assertEqual(data['genres'], ['Jazz'])
+        self.assertEqual(len(data['upcoming_shows']), 2)
+        self.assertEqual(data['upcoming_shows'][0]['artist_name'], 'Artist')
+        self.assertEqual(results.get_json()['count'], 2)
+
+        res = self.client().get('/api/v1/venues/999')
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.get_json()['error'], 404)
+
+    def test_cached_page_etag(self):
+        self.seed(areas=1, venues=2, shows=1)
+        # the first request streams the page and caches it once it is sent
+        first = self.client().get('/venues')
+        self.assertNotIn('ETag', first.headers)
+
+        with sqlstats.collect_statements() as statements:
+            res = self.client().get('/venues')
+        self.assertEqual(statements, [])
+        self.assertEqual(res.get_data(), first.get_data())
+        etag = res.headers['ETag']
+
+        res = self.client().get('/venues', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+
+    def test_streamed_pages_cached_once_sent(self):
+        self.seed(areas=1, venues=2, shows=2)
+        res = self.client().get('/shows', buffered=False)
+        first = next(res.iter_encoded())
+        # the layout goes out before the shows are rendered
+        self.assertIn(b'<!doctype html>', first)
+        self.assertNotIn(b'Venue 0-1', first)
+        res.close()
+
+        # a page cut short isn't cached, one sent in full is
+        self.assertNotIn('ETag', self.client().get('/shows').headers)
+        self.assertIn('ETag', self.client().get('/shows').headers)
+
+    def test_writes_invalidate_pages(self):
+        self.seed(areas=1, venues=2, shows=1)
+        venue, other = Venue.query.order_by(Venue.id).all()
+        artistId = Artist.query.first().id
+        venueId, otherId = venue.id, other.id
+        db.session.remove()
+        client = self.client()
+        for url in ('/venues', '/shows', '/artists/%d' % artistId,
+                '/venues/%d' % venueId, '/venues/%d' % otherId):
+            client.get(url)
+
+        form = self.venueForm('Renamed Venue', city='City 0', state='S0')
+        client.post('/venues/%d/edit' % venueId, data=form)
+        # read the flashed message, so the next pages come from the cache
+        client.get('/')
+
+        for url in ('/venues', '/shows', '/artists/%d' % artistId,
+                '/venues/%d' % venueId):
+            self.assertIn('Renamed Venue', client.get(url).get_data(as_text=True))
+        # a page the change doesn't show up on stays cached
+        with sqlstats.collect_statements() as statements:
+            client.get('/venues/%d' % otherId)
+        self.assertEqual(statements, [])
+
+    def test_commands_invalidate_pages(self):
+        from app import getNow, rolloverShowCounts
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.seed(areas=1, venues=2, shows=1)
+        venueId, otherId = [v.id for v in Venue.query.order_by(Venue.id)]
+        artistId = Artist.query.first().id
+        db.session.remove()
+        client = self.client()
+        urls = ['/venues', '/artists', '/shows', '/artists/%d' % artistId,
+            '/venues/%d' % venueId, '/venues/%d' % otherId]
+
+        def cachedUrls():
+            cached = []
+            for url in urls:
+                with sqlstats.collect_statements() as statements:
+                    client.get(url)
+                if not statements:
+                    cached.append(url)
+            return cached
+
+        cachedUrls()
+        self.assertEqual(cachedUrls(), urls)
+        show = json.dumps({'venue_id': venueId, 'artist_id': artistId,
+            'start_time': (datetime.now() + timedelta(days=1)).isoformat()})
+        res = self.runImport('shows', show + '\n', '.ndjson')
+        self.assertEqual(res.exit_code, 0, res.output)
+        self.assertEqual(cachedUrls(), ['/venues/%d' % otherId])
+
+        with mock.patch('app.getNow', return_value=getNow() + timedelta(days=2)):
+            rolloverShowCounts()
+        self.assertEqual(cachedUrls(), urls[2:])
+
+    def test_flashed_pages_not_cached(self):
+        self.seed(areas=1, venues=1, shows=1)
+        url = '/venues/%d' % Venue.query.first().id
+        client = self.client()
+        client.post(url + '/edit', data=self.venueForm('New Name'))
+        # the edit redirects to the venue page, which shows the message once
+        self.assertIn('New Name was successfully updated',
+            client.get(url).get_data(as_text=True))
+        self.assertNotIn('successfully updated',
+            client.get(url).get_data(as_text=True))
+
+    def test_pool_metrics(self):
+        import sqlite3
+        from sqlalchemy.exc import TimeoutError
+        from pool import TimedQueuePool
+        pool = TimedQueuePool(lambda: sqlite3.connect(':memory:'),
+            pool_size=1, max_overflow=1, timeout=0.05)
+        first = pool.connect()
+        second = pool.connect()
+        # the pool and its overflow are used up, so the next checkout waits
+        with self.assertRaises(TimeoutError):
+            pool.connect()
+
+        with mock.patch.object(db.engine, 'pool', pool):
+            res = self.client().get('/metrics')
+        first.close()
+        second.close()
+        metrics = dict(line.split() for line in
+            res.get_data(as_text=True).splitlines())
+        self.assertEqual(metrics['fyyur_db_pool_checked_out'], '2')
+        self.assertEqual(metrics['fyyur_db_pool_overflow'], '1')
+        self.assertEqual(metrics['fyyur_db_pool_checkouts_total'], '3')
+        self.assertEqual(metrics['fyyur_db_pool_checkout_timeouts_total'], '1')
+        self.assertGreaterEqual(
+            float(metrics['fyyur_db_pool_checkout_wait_seconds_max']), 0.05)
+
+    def test_query_stats_headers_and_slow_log(self):
+        self.seed(areas=1, venues=2, shows=1)
+        venueId = Venue.query.first().id
+        res = self.client().get('/venues/%d/edit' % venueId)
+        self.assertEqual(res.headers['X-SQL-Query-Count'], '1')
+        float(res.headers['X-SQL-Query-Time'])
+
+        with mock.patch.dict(app.config, SLOW_QUERY_MS=0), \
+                self.assertLogs('sqlstats', 'WARNING') as logs:
+            self.client().get('/venues/%d/edit' % venueId)
+        self.assertIn('slow query', logs.output[0])
+
+        with self.assertRaises(AssertionError):
+            with sqlstats.query_budget(1):
+                Venue.query.all()
+                Artist.query.all()
+
+    def test_streamed_pages_log_query_totals(self):
+        self.seed(areas=1, venues=2, shows=1)
+        with sqlstats.collect_statements() as statements, \
+                self.assertLogs('sqlstats', 'INFO') as logs:
+            res = self.client().get('/shows')
+        # the shows are read after the headers are sent
+        self.assertNotIn('X-SQL-Query-Count', res.headers)
+        self.assertEqual(len(logs.output), 1)
+        self.assertRegex(logs.output[0],
+            r'GET /shows ran %d queries in [\d.]+ ms' % len(statements))
+        self.assertGreater(len(statements), 0)
+
+    def test_query_stats_forget_failed_queries(self):
+        connection = db.session.connection()
+        for _ in range(2):
+            with self.assertRaises(SQLAlchemyError):
+                connection.exec_driver_sql('SELECT * FROM no_such_table')
+        self.assertEqual(connection.info['sqlstats_started'], [])
+
+    def test_hot_queries_use_indexes(self):
+        from app import getShows, getShowsPage, pagesShowing, \
+            rolloverShowCounts
+        self.seed(areas=2, venues=3, shows=3)
+        venue = Venue.query.first()
+        artist = Artist.query.first()
+        first = getShowsPage(limit=2)[0][-1]
+
+        with self.captureQueries() as queries:
+            getShows(venue)
+            getShows(artist)
+            getShowsPage(limit=2)
+            getShowsPage([first['start_time'], first['id']], 2)
+            pagesShowing(Venue, venue.id)
+            pagesShowing(Artist, artist.id)
+            rolloverShowCounts()
+
+        checked = 0
+        for statement, parameters in queries:
+            if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE')):
+                continue
+            checked += 1
+            # the first page of shows may read the time index from the start
+            if 'LIMIT' in statement and 'WHERE' not in statement:
+                continue
+            plan = self.explain(statement, parameters)
+            self.assertEqual(self.fullScans(plan), [], statement)
+        self.assertGreaterEqual(checked, 8)
+
+
+@pytest.fixture
+def fyyur():
+    """The set up test case, for tests written as pytest functions."""
+    case = FyyurTestCase()
+    case.setUp()
+    yield case
+    case.tearDown()
+
+
+def test_shows_query_budget(fyyur, query_budget):
+    fyyur.seed(areas=2, venues=5, shows=3)
+    # one joined query, not two lookups per show
+    query_budget(2)
+    res = fyyur.client().get('/shows')
+
+    assert res.status_code == 200
+    assert 'Venue 1-4' in res.get_data(as_text=True)
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()
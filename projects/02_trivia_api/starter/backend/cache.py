@@ -0,0 +1,155 @@
+'''
+Small caches of values read from the database on most requests: the number
+and id range of the questions of each category, the category names, and
+where each page of the question list starts.
+
+Each worker keeps its own. A commit that adds, removes or recategorises
+questions, or changes categories, drops what it changed from the caches of
+its worker once it commits; the caches of other workers pick it up when
+their entries expire.
+'''
+import time
+from threading import Lock
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import get_history
+
+from models import db, Question, Category
+
+# seconds an entry is kept
+TTL = 60
+
+ALL = 'all'
+
+def category_key(category):
+  return ALL if category is None else str(category)
+
+def in_category(query, category):
+  if category is None:
+    return query
+  return query.filter(Question.category == category)
+
+'''
+ReadCache
+    a dict of values read from the database, kept for ttl seconds or until
+    they are forgotten. Values are only stored if nothing was forgotten while
+    they were read, as they may miss the change that was.
+'''
+class ReadCache:
+  def __init__(self, ttl=TTL):
+    self.ttl = ttl
+    self.entries = {}  # key -> (value, expiry time)
+    self.generation = 0
+    self.lock = Lock()
+
+  # returns the value of the key, calling load() for it if it isn't cached
+  def get(self, key, load):
+    with self.lock:
+      entry = self.entries.get(key)
+      generation = self.generation
+    if entry is not None and entry[1] > time.monotonic():
+      return entry[0]
+    value = load()
+    self.set(key, value, generation)
+    return value
+
+  # returns the cached entries, and the generation to set new ones with
+  def snapshot(self):
+    now = time.monotonic()
+    with self.lock:
+      return ({key: value for key, (value, expires) in self.entries.items()
+        if expires > now}, self.generation)
+
+  def set(self, key, value, generation):
+    with self.lock:
+      if generation == self.generation:
+        self.entries[key] = (value, time.monotonic() + self.ttl)
+
+  def forget(self, keys=None):
+    with self.lock:
+      self.generation += 1
+      if keys is None:
+        self.entries.clear()
+      for key in keys or ():
+        self.entries.pop(key, None)
+
+question_stats_cache = ReadCache()
+categories_cache = ReadCache()
+# page number -> id of the last question before it, for the question list
+page_starts = ReadCache()
+
+'''
+question_stats(category)
+    returns the number of questions in the category (in all categories if it
+    is None) and their lowest and highest id
+'''
+def question_stats(category=None):
+  return question_stats_cache.get(category_key(category),
+    lambda: tuple(in_category(db.session.query(
+      func.count(Question.id), func.min(Question.id), func.max(Question.id)
+    ), category).one()))
+
+'''
+category_types()
+    returns a dict of the categories' types by id, the ids as strings
+'''
+def category_types():
+  return categories_cache.get(ALL, lambda: {
+    str(category.id): category.type
+    for category in Category.query.order_by(Category.id)
+  })
+
+def clear():
+  for cache in (question_stats_cache, categories_cache, page_starts):
+    cache.forget()
+
+# Changes are noted in session.info while a transaction flushes them, and
+# forgotten once it commits.
+
+def note(target, key, values=()):
+  session = object_session(target)
+  if session is not None:
+    session.info.setdefault(key, set()).update(values)
+
+# notes questions of the categories written without the ORM, e.g. by a bulk
+# insert
+def note_questions_written(session, categories):
+  session.info.setdefault('question_categories', set()).update(categories)
+  session.info.setdefault('question_pages', set()).add(True)
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_delete')
+def note_question(mapper, connection, target):
+  note(target, 'question_categories', [target.category])
+  # pages after it start at another question now
+  note(target, 'question_pages', [True])
+
+@event.listens_for(Question, 'after_update')
+def note_moved_question(mapper, connection, target):
+  moved_from = get_history(target, 'category').deleted
+  if moved_from:
+    note(target, 'question_categories', [target.category] + list(moved_from))
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def note_category(mapper, connection, target):
+  note(target, 'categories', [True])
+
+@event.listens_for(Session, 'after_commit')
+def forget_changes(session):
+  categories = session.info.pop('question_categories', None)
+  if categories:
+    question_stats_cache.forget([category_key(c) for c in categories] + [ALL])
+  if session.info.pop('question_pages', None):
+    page_starts.forget()
+  if session.info.pop('categories', None):
+    categories_cache.forget()
+    # deleting a category uncategorises its questions in the database
+    question_stats_cache.forget()
+
+@event.listens_for(Session, 'after_rollback')
+def drop_changes(session):
+  for key in ('question_categories', 'question_pages', 'categories'):
+    session.info.pop(key, None)
@@ -0,0 +1,100 @@
+import time
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from sqlalchemy import inspect, text
+
+from loader import BatchError, guess_format, load_questions, read_records
+from models import db
+
+trivia_cli = AppGroup('trivia', help='Maintain the trivia database.')
+
+@click.command('db-init')
+@with_appcontext
+def db_init_command():
+  """Create the tables of the models that don't exist yet.
+
+  Run this once on a new database, then `flask db upgrade`. Databases
+  restored from trivia.psql only need `flask db upgrade`. Apps don't create
+  tables when they start, so workers and tests don't pay for it.
+  """
+  db.create_all()
+  click.echo('created the trivia tables')
+
+@trivia_cli.command('backfill-categories')
+@click.option('--batch-size', default=1000, show_default=True,
+  help='Questions updated per transaction.')
+@click.option('--pause', default=0.0, show_default=True,
+  help='Seconds to wait between batches, to leave room for other writes.')
+def backfill_categories_command(batch_size, pause):
+  """Copy question categories into the category_id column.
+
+  Run this between `flask db upgrade b31d8e6a4c27`, which adds the column,
+  and `flask db upgrade`, which swaps it in for the string category column.
+  Questions are updated a range of ids at a time, each range in its own
+  short transaction, so no row stays locked for long. Safe to stop and run
+  again. The previous release keeps serving until the swap, as this one
+  only works with integer categories.
+  """
+  columns = [column['name'] for column in
+    inspect(db.engine).get_columns('questions')]
+  if 'category_id' not in columns:
+    click.echo('questions have no category_id column, nothing to backfill')
+    return
+
+  low, high = db.session.execute(
+    text('SELECT min(id), max(id) FROM questions')).first()
+  db.session.commit()
+  if low is None:
+    return
+
+  started = time.perf_counter()
+  updated = 0
+  # ids up to start are done
+  start = low - 1
+  while start < high:
+    stop = start + batch_size
+    result = db.session.execute(text('''
+      UPDATE questions SET category_id = NULLIF(category, '')::integer
+      WHERE id > :start AND id <= :stop
+        AND category_id IS NULL AND coalesce(category, '') <> ''
+    '''), {'start': start, 'stop': stop})
+    db.session.commit()
+    updated += result.rowcount
+    start = stop
+    click.echo('%d questions updated, up to id %d of %d' %
+      (updated, min(stop, high), high))
+    if pause:
+      time.sleep(pause)
+
+  click.echo('done in %.1fs' % (time.perf_counter() - started))
+
+@trivia_cli.command('load')
+@click.argument('file', type=click.File('r', encoding='utf-8'))
+@click.option('--format', type=click.Choice(['csv', 'ndjson']),
+  help='File format, guessed from the file name if left out.')
+@click.option('--batch-size', default=1000, show_default=True,
+  help='Questions inserted per transaction.')
+def load_command(file, format, batch_size):
+  """Load questions from a CSV or NDJSON file.
+
+  Records have the fields of POST /questions: question, answer, category
+  (an id or a type) and difficulty. Records that aren't valid are reported
+  and skipped; a batch the database rejects stops the load, keeping the
+  batches before it.
+  """
+  def progress(report, error):
+    if error is not None:
+      click.echo(str(error), err=True)
+    else:
+      click.echo('%d questions loaded, %.0f questions/s' %
+        (report['loaded'], report['questions_per_second']), err=True)
+
+  records = read_records(file, format or guess_format(file.name))
+  try:
+    report = load_questions(records, batch_size, progress)
+  except BatchError as e:
+    raise click.ClickException(str(e))
+  click.echo('loaded %d questions, rejected %d, in %.2fs (%.0f questions/s)'
+    % (report['loaded'], report['rejected'], report['seconds'],
+      report['questions_per_second']))
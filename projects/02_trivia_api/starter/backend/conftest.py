@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+import testdb
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('trivia')
+    group.addoption('--no-timings', action='store_true',
+        help="don't print how long each test took")
+    group.addoption('--timings-json', metavar='PATH',
+        help='also write how long each test took to this file, as json')
+
+
+@pytest.fixture(scope='session')
+def app():
+    '''the app, on this worker's clone of the test database (see testdb.py)'''
+    return testdb.shared_app()
+
+
+@pytest.fixture
+def session(app):
+    '''db.session for the test, rolled back when it ends'''
+    with testdb.isolated(app) as session:
+        yield session
+
+
+@pytest.fixture
+def client(app, session):
+    return app.test_client()
+
+
+# seconds each test spent in setup, call and teardown, by test id. with
+# pytest-xdist, the workers' reports arrive here in the main process.
+_timings = {}
+
+
+def pytest_runtest_logreport(report):
+    timing = _timings.setdefault(report.nodeid, {})
+    timing[report.when] = report.duration
+    node = getattr(report, 'node', None)
+    if node is not None:
+        timing['worker'] = node.gateway.id
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    '''prints how long each test took, slowest first'''
+    if hasattr(config, 'workerinput') or not _timings:
+        return
+    rows = []
+    for nodeid, timing in _timings.items():
+        phases = [timing.get(when, 0.0) * 1000
+            for when in ('setup', 'call', 'teardown')]
+        rows.append([sum(phases)] + phases + [timing.get('worker', ''),
+            nodeid])
+    rows.sort(key=lambda row: -row[0])
+
+    if not config.getoption('no_timings'):
+        terminalreporter.write_sep('=', 'test timings (ms)')
+        terminalreporter.write_line('%9s %9s %9s %9s  %-6s %s' % ('total',
+            'setup', 'call', 'teardown', 'worker', 'test'))
+        for row in rows:
+            terminalreporter.write_line(
+                '%9.1f %9.1f %9.1f %9.1f  %-6s %s' % tuple(row))
+        terminalreporter.write_line('%9.1f ms in %d tests' %
+            (sum(row[0] for row in rows), len(rows)))
+
+    path = config.getoption('timings_json')
+    if path:
+        keys = ('total_ms', 'setup_ms', 'call_ms', 'teardown_ms', 'worker',
+            'test')
+        with open(path, 'w') as f:
+            json.dump([dict(zip(keys, row)) for row in rows], f, indent=2)
@@ -1,17 +1,81 @@
+import io
 import os
 from flask import Flask, request, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import random
 
-from models import setup_db, Question, Category
+from cache import category_types, page_starts, question_stats
+from commands import db_init_command, trivia_cli
+from loader import BatchError, guess_format, load_questions, read_records
+from models import setup_db, db, Question, Category
+from quizzes import random_question_id
+from search import search_questions
+from sqlstats import init_sql_stats
 
 QUESTIONS_PER_PAGE = 10
+# questions inserted per transaction by POST /questions/bulk
+BULK_BATCH_SIZE = 1000
+MAX_BULK_BATCH_SIZE = 10000
+
+'''
+Question pages are read by keyset: a page is the QUESTIONS_PER_PAGE
+questions after the last id of the page before it, which costs the same on
+every page where an OFFSET reads and skips every question before the page.
+
+Pages asked for by number (?page=3) start after the id cached for that page
+number. Pages not cached yet are found with an OFFSET from the nearest page
+before them that is, using only the id index, and every page served caches
+where the next one starts, so paging through the list or going back to a
+page reads no more than its questions.
+'''
+
+'''
+get_question_page(after)
+    returns the questions after the given id (from the first if it is None)
+    and the id the page after them starts after, or None on the last page
+'''
+def get_question_page(after=None, limit=QUESTIONS_PER_PAGE):
+  query = Question.query
+  if after is not None:
+    query = query.filter(Question.id > after)
+  questions = query.order_by(Question.id).limit(limit + 1).all()
+  if len(questions) > limit:
+    return questions[:limit], questions[limit - 1].id
+  return questions, None
+
+'''
+find_page_start(page)
+    returns the id page number page starts after (None for the first page),
+    or aborts with 404 if there are fewer pages
+'''
+def find_page_start(page, limit=QUESTIONS_PER_PAGE):
+  cached, generation = page_starts.snapshot()
+  if page in cached or page == 1:
+    return cached.get(page)
+
+  nearest = max([p for p in cached if p < page], default=1)
+  query = db.session.query(Question.id)
+  if cached.get(nearest) is not None:
+    query = query.filter(Question.id > cached[nearest])
+  # the last question of the page before
+  row = query.order_by(Question.id) \
+    .offset((page - nearest) * limit - 1).limit(1).first()
+  if row is None:
+    abort(404)
+  page_starts.set(page, row.id, generation)
+  return row.id
 
 def create_app(test_config=None):
-  # create and configure the app
+  # create and configure the app. the database is only connected to by the
+  # first query, so this is cheap enough to run per worker and per test
   app = Flask(__name__)
-  setup_db(app)
+  if test_config is not None:
+    app.config.from_mapping(test_config)
+  setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI'))
+  init_sql_stats(app)
+  app.cli.add_command(db_init_command)
+  app.cli.add_command(trivia_cli)
   
   '''
   @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -22,24 +86,48 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests 
-  for all available categories.
+  GET /categories
+      returns the types of the categories by id
   '''
-
+  @app.route('/categories')
+  def get_categories():
+    return jsonify({
+      'success': True,
+      'categories': category_types()
+    })
 
   '''
-  @TODO: 
-  Create an endpoint to handle GET requests for questions, 
-  including pagination (every 10 questions). 
-  This endpoint should return a list of questions, 
-  number of total questions, current category, categories. 
-
-  TEST: At this point, when you start the application
-  you should see questions and categories generated,
-  ten questions per page and pagination at the bottom of the screen for three pages.
-  Clicking on the page numbers should update the questions. 
+  GET /questions?page=1 or GET /questions?after=10
+      returns a page of questions, the number of questions, the categories
+      and, in next, the after value of the next page (null on the last page).
+      Pages are numbered from 1; after pages start after a question id.
   '''
+  @app.route('/questions')
+  def get_questions():
+    after = request.args.get('after', type=int)
+    page = None
+    if after is None:
+      page = request.args.get('page', 1, type=int)
+      if page < 1:
+        abort(404)
+      _, generation = page_starts.snapshot()
+      after = find_page_start(page)
+
+    questions, next_after = get_question_page(after)
+    if not questions and (after is not None or page != 1):
+      abort(404)
+    if page is not None and next_after is not None:
+      page_starts.set(page + 1, next_after, generation)
+
+    return jsonify({
+      'success': True,
+      'questions': [question.format() for question in questions],
+      'total_questions': question_stats()[0],
+      'categories': category_types(),
+      'current_category': None,
+      'page': page,
+      'next': next_after
+    })
 
   '''
   @TODO: 
@@ -50,26 +138,90 @@ def create_app(test_config=None):
   '''
 
   '''
-  @TODO: 
-  Create an endpoint to POST a new question, 
-  which will require the question and answer text, 
-  category, and difficulty score.
-
-  TEST: When you submit a question on the "Add" tab, 
-  the form will clear and the question will appear at the end of the last page
-  of the questions list in the "List" tab.  
+  POST /questions
+      with a searchTerm, returns a page (page, from 1) of the questions
+      matching it, best matches first, each with its text highlighted in
+      highlight, and the number of matches in total_questions. Otherwise
+      creates the question with the given question, answer, category and
+      difficulty.
   '''
+  @app.route('/questions', methods=['POST'])
+  def post_question():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      abort(400)
+    if 'searchTerm' in body:
+      return search(body)
 
-  '''
-  @TODO: 
-  Create a POST endpoint to get questions based on a search term. 
-  It should return any questions for whom the search term 
-  is a substring of the question. 
+    question = body.get('question')
+    answer = body.get('answer')
+    try:
+      difficulty = int(body.get('difficulty'))
+      category = int(body.get('category'))
+    except (TypeError, ValueError):
+      abort(422)
+    if not isinstance(question, str) or not question.strip() or \
+        not isinstance(answer, str) or not answer.strip() or \
+        not 1 <= difficulty <= 5 or str(category) not in category_types():
+      abort(422)
 
-  TEST: Search by any phrase. The questions list will update to include 
-  only question that include that string within their question. 
-  Try using the word "title" to start. 
+    question = Question(question.strip(), answer.strip(), category,
+      difficulty)
+    question.insert()
+    return jsonify({
+      'success': True,
+      'created': question.id
+    })
+
+  '''
+  POST /questions/bulk?format=ndjson&batch_size=1000
+      loads the questions of a CSV or newline-delimited JSON body (by format,
+      or else the content type), batch_size per transaction, and returns the
+      number loaded and rejected, the errors of the first rejected rows and
+      the throughput. See loader.py.
   '''
+  @app.route('/questions/bulk', methods=['POST'])
+  def load_questions_in_bulk():
+    format = request.args.get('format') or guess_format(request.content_type)
+    batch_size = request.args.get('batch_size', BULK_BATCH_SIZE, type=int)
+    if format not in ('csv', 'ndjson'):
+      abort(400)
+    if not 1 <= batch_size <= MAX_BULK_BATCH_SIZE:
+      abort(422)
+
+    # read as it arrives, never holding the whole body
+    body = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+      report = load_questions(read_records(body, format), batch_size)
+    except UnicodeDecodeError:
+      abort(400)
+    except BatchError as e:
+      return jsonify(dict(e.report,
+        success=False,
+        error=422,
+        message=str(e)
+      )), 422
+    return jsonify(dict(report, success=True))
+
+  def search(body):
+    term = body.get('searchTerm')
+    try:
+      page = int(body.get('page') or 1)
+    except (TypeError, ValueError):
+      abort(422)
+    if not isinstance(term, str) or page < 1:
+      abort(422)
+
+    questions, total = search_questions(term, page, QUESTIONS_PER_PAGE)
+    if not questions and page > 1:
+      abort(404)
+    return jsonify({
+      'success': True,
+      'questions': questions,
+      'total_questions': total,
+      'current_category': None,
+      'page': page
+    })
 
   '''
   @TODO: 
@@ -82,23 +234,67 @@ def create_app(test_config=None):
 
 
   '''
-  @TODO: 
-  Create a POST endpoint to get questions to play the quiz. 
-  This endpoint should take category and previous question parameters 
-  and return a random questions within the given category, 
-  if provided, and that is not one of the previous questions. 
-
-  TEST: In the "Play" tab, after a user selects "All" or a category,
-  one question at a time is displayed, the user is allowed to answer
-  and shown whether they were correct or not. 
+  POST /quizzes
+      takes the quiz category ({'id': ..., 'type': ...}, id 0 for all
+      categories) and the ids of the previous questions, and returns a random
+      question of the category that isn't one of them, or null once every
+      question was asked. See quizzes.py for how it is picked.
   '''
+  @app.route('/quizzes', methods=['POST'])
+  def play_quiz():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+      abort(400)
+
+    previous = body.get('previous_questions') or []
+    quiz_category = body.get('quiz_category') or {}
+    if not isinstance(previous, list) or not isinstance(quiz_category, dict):
+      abort(422)
+    try:
+      previous = [int(id) for id in previous]
+      category = int(quiz_category.get('id') or 0) or None
+    except (TypeError, ValueError):
+      abort(422)
+    if category is not None and Category.query.get(category) is None:
+      abort(404)
+
+    question = None
+    while question is None:
+      question_id = random_question_id(category, previous)
+      if question_id is None:
+        break
+      # None if it was deleted after it was picked; then pick another
+      question = Question.query.get(question_id)
+      previous.append(question_id)
+
+    return jsonify({
+      'success': True,
+      'question': question.format() if question else None
+    })
 
   '''
-  @TODO: 
-  Create error handlers for all expected errors 
-  including 404 and 422. 
+  Error handlers
+      answer every expected error with
+      {'success': False, 'error': code, 'message': name}
   '''
-  
+  def error_response(error):
+    return jsonify({
+      'success': False,
+      'error': error.code,
+      'message': error.name.lower()
+    }), error.code
+
+  for code in (400, 404, 405, 422):
+    app.register_error_handler(code, error_response)
+
+  @app.errorhandler(500)
+  def server_error(error):
+    return jsonify({
+      'success': False,
+      'error': 500,
+      'message': 'internal server error'
+    }), 500
+
   return app
 
     
\ No newline at end of file
@@ -0,0 +1,182 @@
+'''
+Bulk loading of questions, for POST /questions/bulk and `flask trivia load`.
+
+Records are read from CSV or newline-delimited JSON one at a time, so a
+file or request body can be far larger than memory. Each is checked as it
+is read, and the valid ones are inserted a batch at a time, one transaction
+and one multi-row INSERT per batch, instead of one transaction per question
+as Question.insert() does. Records that aren't valid are reported by line
+and skipped.
+
+Records have the fields of POST /questions: question, answer, category (an
+id, or a category type like "Science") and difficulty (1 to 5).
+'''
+import csv
+import json
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from cache import category_types, note_questions_written
+from models import db, Question
+from search import forget_search_index
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+# per-row errors listed in a report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+class RecordError(ValueError):
+  def __init__(self, line, message):
+    super().__init__('line %d: %s' % (line, message))
+    self.line = line
+    self.message = message
+
+# a batch the database rejected, with the report of the load up to it
+class BatchError(Exception):
+  def __init__(self, line, error, report):
+    super().__init__('batch ending on line %d was rejected: %s'
+      % (line, error))
+    self.line = line
+    self.report = report
+
+# guesses csv or ndjson from a file name or content type
+def guess_format(name):
+  name = (name or '').lower()
+  if name.endswith('.csv') or name.startswith('text/csv'):
+    return 'csv'
+  return 'ndjson'
+
+# yields (line number, raw dict) for each record of an open text file
+def read_records(file, format):
+  if format == 'csv':
+    reader = csv.DictReader(file)
+    for record in reader:
+      yield reader.line_num, record
+  else:
+    for line, text in enumerate(file, 1):
+      if text.strip():
+        try:
+          yield line, json.loads(text)
+        except ValueError as e:
+          yield line, RecordError(line, 'invalid json: %s' % e)
+
+# returns the category id of an id or type, or None if there is no such
+# category
+def find_category(value, categories):
+  value = str(value).strip()
+  if value in categories:
+    return int(value)
+  for id, type in categories.items():
+    if type.lower() == value.lower():
+      return int(id)
+  return None
+
+'''
+convert_record(line, record, categories)
+    returns the record as the values of a question row, or raises
+    RecordError naming the line if it isn't a valid question
+'''
+def convert_record(line, record, categories):
+  if isinstance(record, RecordError):
+    raise record
+  if not isinstance(record, dict):
+    raise RecordError(line, 'expected an object')
+  unknown = set(record) - set(FIELDS)
+  if unknown:
+    raise RecordError(line, 'unknown field %r' % sorted(unknown)[0])
+
+  row = {}
+  for key in ('question', 'answer'):
+    value = record.get(key)
+    if not isinstance(value, str) or not value.strip():
+      raise RecordError(line, 'missing %s' % key)
+    row[key] = value.strip()
+
+  if record.get('category') in (None, ''):
+    raise RecordError(line, 'missing category')
+  row['category'] = find_category(record['category'], categories)
+  if row['category'] is None:
+    raise RecordError(line, 'unknown category %r' % record['category'])
+
+  try:
+    row['difficulty'] = int(record.get('difficulty'))
+  except (TypeError, ValueError):
+    raise RecordError(line, 'invalid difficulty %r' % record.get('difficulty'))
+  if not 1 <= row['difficulty'] <= 5:
+    raise RecordError(line, 'difficulty %d is not from 1 to 5'
+      % row['difficulty'])
+  return row
+
+# yields lists of up to size items
+def batched(items, size):
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+  if batch:
+    yield batch
+
+# inserts the question rows in one transaction
+def insert_questions(rows):
+  try:
+    db.session.execute(Question.__table__.insert(), rows)
+    # the insert skips the ORM events that keep the caches current
+    note_questions_written(db.session, set(row['category'] for row in rows))
+    db.session.commit()
+  except BaseException:
+    db.session.rollback()
+    raise
+  forget_search_index()
+
+'''
+load_questions(records, batch_size, on_progress)
+    inserts the valid ones of the (line, record) pairs, batch_size questions
+    per transaction, and returns a report of the load: the number of
+    questions loaded and rejected, the errors of the first rejected rows,
+    and the seconds and questions per second it took. on_progress, if given,
+    is called with the report so far and the error after each rejected row,
+    and with None for the error after each batch.
+
+    A batch the database rejects raises BatchError, keeping the batches
+    before it.
+'''
+def load_questions(records, batch_size=1000, on_progress=None):
+  categories = category_types()
+  started = time.perf_counter()
+  report = {'loaded': 0, 'rejected': 0, 'errors': []}
+
+  def measure():
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['questions_per_second'] = \
+      round(report['loaded'] / elapsed, 1) if elapsed else 0.0
+
+  def progress(error=None):
+    if on_progress is not None:
+      measure()
+      on_progress(report, error)
+
+  for batch in batched(records, batch_size):
+    rows = []
+    for line, record in batch:
+      try:
+        rows.append(convert_record(line, record, categories))
+      except RecordError as e:
+        report['rejected'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+          report['errors'].append({'line': e.line, 'error': e.message})
+        progress(e)
+    if rows:
+      try:
+        insert_questions(rows)
+      except SQLAlchemyError as e:
+        measure()
+        raise BatchError(batch[-1][0], getattr(e, 'orig', None) or e, report)
+      report['loaded'] += len(rows)
+    progress()
+
+  measure()
+  return report
@@ -0,0 +1,33 @@
+"""add a full-text search column and index to questions
+
+Revision ID: 9e4b2c7d1a53
+Revises: 
+Create Date: 2026-10-18 14:21:09.407512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b2c7d1a53'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # kept up to date by postgres (12 or later) whenever a question changes
+    op.execute('''
+        ALTER TABLE questions ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            to_tsvector('english', coalesce(question, ''))
+        ) STORED
+    ''')
+    op.create_index('ix_questions_search_vector', 'questions',
+        ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_questions_search_vector', table_name='questions')
+    op.drop_column('questions', 'search_vector')
@@ -0,0 +1,71 @@
+"""add an integer category_id column to questions
+
+Revision ID: b31d8e6a4c27
+Revises: 9e4b2c7d1a53
+Create Date: 2026-10-18 15:02:37.118640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b31d8e6a4c27'
+down_revision = '9e4b2c7d1a53'
+branch_labels = None
+depends_on = None
+
+# Databases created by db.create_all() stored categories as strings. They
+# move to an integer column in three steps, none of which holds a lock on
+# questions for longer than a catalog change:
+#
+#   1. this migration adds category_id, without scanning the table
+#   2. `flask trivia backfill-categories` fills it in, in small transactions
+#   3. migration c58f2a9e7d10 swaps it in for category
+#
+# Databases restored from trivia.psql already have integer categories and
+# skip to step 3.
+#
+# The app of this revision compares categories as integers, which postgres
+# refuses against the string column, so the previous release serves until
+# step 3 has run; a trigger keeps category_id in step with what it writes.
+
+
+def category_is_integer():
+    columns = sa.inspect(op.get_bind()).get_columns('questions')
+    return any(column['name'] == 'category' and
+        isinstance(column['type'], sa.Integer) for column in columns)
+
+
+def upgrade():
+    if category_is_integer():
+        return
+
+    op.add_column('questions', sa.Column('category_id', sa.Integer(),
+        nullable=True))
+    # NOT VALID skips checking the existing rows; the swap validates them
+    op.execute('''
+        ALTER TABLE questions ADD CONSTRAINT fk_questions_category_id
+        FOREIGN KEY (category_id) REFERENCES categories (id)
+        ON UPDATE CASCADE ON DELETE SET NULL NOT VALID
+    ''')
+    # rows written until the swap fill in category_id themselves
+    op.execute('''
+        CREATE FUNCTION questions_copy_category() RETURNS trigger AS $$
+        BEGIN
+            NEW.category_id := NULLIF(NEW.category, '')::integer;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE TRIGGER questions_copy_category
+        BEFORE INSERT OR UPDATE OF category ON questions
+        FOR EACH ROW EXECUTE PROCEDURE questions_copy_category()
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER IF EXISTS questions_copy_category ON questions')
+    op.execute('DROP FUNCTION IF EXISTS questions_copy_category()')
+    op.execute('ALTER TABLE questions DROP COLUMN IF EXISTS category_id')
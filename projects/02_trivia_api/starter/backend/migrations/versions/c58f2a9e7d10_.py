@@ -0,0 +1,56 @@
+"""make question categories integer foreign keys and index them with ids
+
+Revision ID: c58f2a9e7d10
+Revises: b31d8e6a4c27
+Create Date: 2026-10-18 15:09:52.604218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c58f2a9e7d10'
+down_revision = 'b31d8e6a4c27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    columns = [column['name'] for column in
+        sa.inspect(bind).get_columns('questions')]
+
+    # swap in the category_id column of migration b31d8e6a4c27
+    if 'category_id' in columns:
+        missing = bind.execute(sa.text('''
+            SELECT count(*) FROM questions
+            WHERE category_id IS NULL AND coalesce(category, '') <> ''
+        ''')).scalar()
+        if missing:
+            raise RuntimeError('%d questions have no category_id yet; run '
+                '`flask trivia backfill-categories` first' % missing)
+        # checks the rows without blocking writes
+        op.execute('ALTER TABLE questions '
+            'VALIDATE CONSTRAINT fk_questions_category_id')
+        op.execute('DROP TRIGGER questions_copy_category ON questions')
+        op.execute('DROP FUNCTION questions_copy_category()')
+        op.drop_column('questions', 'category')
+        op.alter_column('questions', 'category_id',
+            new_column_name='category')
+        op.execute('ALTER TABLE questions RENAME CONSTRAINT '
+            'fk_questions_category_id TO fk_questions_category')
+
+    # built without blocking writes, which can't happen in a transaction.
+    # tables made by `flask db-init` have it already
+    with op.get_context().autocommit_block():
+        op.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS '
+            'ix_questions_category ON questions (category, id)')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_questions_category', table_name='questions',
+            postgresql_concurrently=True)
+    # categories stay integers; converting them back to strings isn't
+    # worth a table rewrite
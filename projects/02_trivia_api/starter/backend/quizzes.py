@@ -0,0 +1,82 @@
+'''
+Picks the questions of a quiz.
+
+Ids are shared by all categories, so a category's are spread unevenly over
+the id range, and picking the first question after a random id would favour
+the questions after the widest gaps. Questions are picked by rejection
+instead: ids are drawn at random from the lowest to the highest id of the
+category, looked up on the primary key a batch at a time, and the first drawn
+id that is a question of the category not asked before is picked. Every
+question left is as likely to be picked as any other, and a pick usually
+costs one query of DRAWS point lookups however many questions there are.
+
+When DRAW_ROUNDS batches all miss, because the category is a small part of
+its id range or most of it was asked, the question is picked by its rank
+among those left instead, read as an OFFSET into the category's ids on the
+index on (category, id). That is also uniform, but reads as many ids from the
+index as the rank, half the category on average.
+
+The count and id range of each category come from the cache in cache.py, so
+questions added by other workers since it was read can only be picked once
+the range is read again.
+'''
+import random
+
+from cache import in_category, question_stats
+from models import db, Question
+
+# ids drawn per query, and queries before picking by rank instead
+DRAWS = 16
+DRAW_ROUNDS = 3
+
+'''
+random_question_id(category, previous_questions)
+    returns the id of a random question of the category (of any category if
+    it is None) that isn't one of the previous question ids, or None when
+    every question was asked
+'''
+def random_question_id(category=None, previous_questions=(), rng=random):
+  count, low, high = question_stats(category)
+  previous = set(previous_questions)
+  if count:
+    for _ in range(DRAW_ROUNDS):
+      draws = [rng.randint(low, high) for _ in range(DRAWS)]
+      candidates = set(draws) - previous
+      if not candidates:
+        continue
+      found = set(id for id, in in_category(db.session.query(Question.id),
+        category).filter(Question.id.in_(candidates)))
+      for id in draws:
+        if id in found:
+          return id
+  return pick_by_rank(category, count, previous, rng)
+
+'''
+pick_by_rank(category, count, previous)
+    returns the id of a random question of the category that isn't one of
+    the previous ids by its rank among them, or None when every question was
+    asked; count is the number of questions of the category
+'''
+def pick_by_rank(category, count, previous, rng=random):
+  query = in_category(db.session.query(Question.id), category)
+  if previous:
+    left = count - query.filter(Question.id.in_(previous)).count()
+    query = query.filter(~Question.id.in_(previous))
+  else:
+    left = count
+  query = query.order_by(Question.id)
+
+  if left <= 0:
+    # every question counted was asked, but the count may be short of the
+    # questions added since by other workers
+    return query.limit(1).scalar()
+  # it may also be over by the questions they deleted, and a rank past the
+  # last question reads nothing. Each miss lowers the bound to the rank that
+  # missed, which keeps the pick uniform over the questions there are.
+  while left > 0:
+    rank = rng.randrange(left)
+    id = query.offset(rank).limit(1).scalar()
+    if id is not None:
+      return id
+    left = rank
+  return None
@@ -0,0 +1,194 @@
+'''
+Question search.
+
+On postgres, questions are matched against their search_vector column, a
+tsvector of the question kept up to date by the database (see migration
+9e4b2c7d1a53), through its GIN index. Matches are ranked with ts_rank_cd
+and only the questions of the page asked for get a highlighted snippet from
+ts_headline, so a search reads the index and its matches instead of every
+question.
+
+Elsewhere (e.g. sqlite) an in-process inverted index of the questions' words
+stands in. It is dropped whenever a question is written and rebuilt on the
+next search. It doesn't stem words like postgres does, so results differ a
+little from postgres for words with different endings.
+
+Each word of a search term matches the words of a question that start with
+it, and a question has to match every word of the term.
+'''
+import bisect
+import html
+import math
+import re
+
+from sqlalchemy import event, func, literal_column
+
+from models import db, Question
+
+SEARCH_CONFIG = 'english'
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_STOP = '</mark>'
+HIGHLIGHT_OPTIONS = 'StartSel=%s, StopSel=%s, MaxWords=35, MinWords=15' \
+  % (HIGHLIGHT_START, HIGHLIGHT_STOP)
+
+# what html.escape(text, quote=False) replaces, & first so the others'
+# entities aren't escaped again. Highlights are element text, not attribute
+# values, so quotes are left alone.
+HTML_ESCAPES = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'))
+
+WORD = re.compile(r'[^\W_]+')
+
+def words(text):
+  return WORD.findall(text.lower())
+
+# question text is shown as html with its highlights, so it is escaped
+def escape(text):
+  return html.escape(text, quote=False)
+
+# the column's text escaped like escape(), so the only tags in what
+# ts_headline makes of it are the highlight's
+def escaped(column):
+  for character, entity in HTML_ESCAPES:
+    column = func.replace(column, character, entity)
+  return column
+
+'''
+InvertedIndex
+    the words of each question, for searching questions in process
+'''
+class InvertedIndex:
+  def __init__(self, rows=()):
+    self.texts = {}     # id -> question
+    self.postings = {}  # word -> {id: times the word is in the question}
+    self.vocabulary = None  # sorted words, built on the next search
+    for id, text in rows:
+      self.add(id, text)
+
+  def add(self, id, text):
+    self.texts[id] = text
+    for word in words(text or ''):
+      ids = self.postings.setdefault(word, {})
+      ids[id] = ids.get(id, 0) + 1
+    self.vocabulary = None
+
+  # returns the words starting with prefix
+  def complete(self, prefix):
+    if self.vocabulary is None:
+      self.vocabulary = sorted(self.postings)
+    start = bisect.bisect_left(self.vocabulary, prefix)
+    end = bisect.bisect_left(self.vocabulary, prefix + '\U0010ffff')
+    return self.vocabulary[start:end]
+
+  # returns (id, score) pairs of the questions matching every word of the
+  # term, best matches first
+  def search(self, term):
+    scores = None
+    for prefix in set(words(term)):
+      matches = {}
+      for word in self.complete(prefix):
+        for id, count in self.postings[word].items():
+          matches[id] = matches.get(id, 0) + count
+      if scores is None:
+        scores = matches
+      else:
+        scores = {id: score + matches[id] for id, score in scores.items()
+          if id in matches}
+      if not scores:
+        return []
+    # like ts_rank_cd, prefer more occurrences in shorter questions
+    ranked = [(id, score / math.log(2 + len(words(self.texts[id] or ''))))
+      for id, score in (scores or {}).items()]
+    ranked.sort(key=lambda pair: (-pair[1], pair[0]))
+    return ranked
+
+  # returns the question as html, with the words the term matches
+  # highlighted
+  def highlight(self, id, term):
+    prefixes = tuple(set(words(term)))
+    text = self.texts[id] or ''
+    parts = []
+    end = 0
+    for match in WORD.finditer(text):
+      if match.group().lower().startswith(prefixes):
+        parts.append(escape(text[end:match.start()]))
+        parts.append(HIGHLIGHT_START + escape(match.group()) +
+          HIGHLIGHT_STOP)
+        end = match.end()
+    parts.append(escape(text[end:]))
+    return ''.join(parts)
+
+search_index = None
+
+def get_search_index():
+  global search_index
+  if search_index is None:
+    search_index = InvertedIndex(
+      db.session.query(Question.id, Question.question))
+  return search_index
+
+def forget_search_index():
+  global search_index
+  search_index = None
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_update')
+@event.listens_for(Question, 'after_delete')
+def drop_search_index(mapper, connection, target):
+  forget_search_index()
+
+# returns the term as a tsquery matching questions with words starting with
+# each of its words, or None if it has no words
+def prefix_query(term):
+  prefixes = words(term)
+  if not prefixes:
+    return None
+  return ' & '.join(prefix + ':*' for prefix in prefixes)
+
+'''
+search_questions(term, page, per_page)
+    returns the formatted questions matching the term on the page, best
+    matches first, each with its highlighted text as escaped html in
+    highlight, and the number of questions matching it
+'''
+def search_questions(term, page=1, per_page=10):
+  if not words(term):
+    return [], 0
+  offset = (page - 1) * per_page
+
+  if db.engine.dialect.name != 'postgresql':
+    index = get_search_index()
+    ranked = index.search(term)
+    ids = [id for id, score in ranked[offset:offset + per_page]]
+    questions = {question.id: question
+      for question in Question.query.filter(Question.id.in_(ids))}
+    results = []
+    for id in ids:
+      if id in questions:
+        results.append(dict(questions[id].format(),
+          highlight=index.highlight(id, term)))
+    return results, len(ranked)
+
+  query = func.to_tsquery(SEARCH_CONFIG, prefix_query(term))
+  vector = literal_column('questions.search_vector')
+  rank = func.ts_rank_cd(vector, query)
+  # the page of matches, with the number of all matches on each row
+  matches = db.session.query(
+    Question.id.label('id'),
+    rank.label('rank'),
+    func.count().over().label('total')
+  ).filter(vector.op('@@')(query)) \
+    .order_by(rank.desc(), Question.id) \
+    .offset(offset).limit(per_page) \
+    .subquery()
+  rows = db.session.query(
+    Question,
+    matches.c.total,
+    func.ts_headline(SEARCH_CONFIG, escaped(Question.question), query,
+      HIGHLIGHT_OPTIONS)
+  ).join(matches, Question.id == matches.c.id) \
+    .order_by(matches.c.rank.desc(), Question.id) \
+    .all()
+
+  results = [dict(question.format(), highlight=highlight)
+    for question, total, highlight in rows]
+  return results, rows[0][1] if rows else 0
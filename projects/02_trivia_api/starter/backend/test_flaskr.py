@@ -1,10 +1,20 @@
+import io
 import os
+import random
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock
 
-from flaskr import create_app
-from models import setup_db, Question, Category
+import pytest
+
+import testdb
+from models import Question, Category
+from loader import RecordError, convert_record, read_records
+import quizzes
+from quizzes import random_question_id
+from search import InvertedIndex
 
 
 class TriviaTestCase(unittest.TestCase):
@@ -12,28 +22,287 @@ class TriviaTestCase(unittest.TestCase):
 
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        # one app per test process, on its own copy of the test database;
+        # each test runs in a transaction rolled back after it, see testdb.py
+        self.app = testdb.shared_app()
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgres://{}/{}".format('localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
+        stack = ExitStack()
+        stack.enter_context(testdb.isolated(self.app))
+        self.addCleanup(stack.close)
 
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    def test_get_categories(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['categories'])
+
+    def test_get_paginated_questions(self):
+        res = self.client().get('/questions?page=1')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['questions']), 10)
+        self.assertTrue(data['total_questions'] > 10)
+        self.assertTrue(data['categories'])
+
+    def test_question_pages_by_number_and_after_match(self):
+        second = json.loads(self.client().get('/questions?page=2').data)
+        first = json.loads(self.client().get('/questions?page=1').data)
+        after = json.loads(
+            self.client().get('/questions?after=%d' % first['next']).data)
+
+        self.assertEqual(first['next'], first['questions'][-1]['id'])
+        self.assertEqual(second['questions'], after['questions'])
+        self.assertEqual(second['next'], after['next'])
+
+    def test_404_sent_requesting_beyond_valid_page(self):
+        res = self.client().get('/questions?page=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_search_questions(self):
+        res = self.client().post('/questions', json={'searchTerm': 'title'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['total_questions'] >= len(data['questions']) > 0)
+        for question in data['questions']:
+            self.assertIn('<mark>', question['highlight'])
+
+    def test_search_highlights_are_escaped(self):
+        self.client().post('/questions', json={'question': '<b>xq</b>',
+            'answer': 'a', 'category': 1, 'difficulty': 1})
+        res = self.client().post('/questions', json={'searchTerm': 'xq'})
+        data = json.loads(res.data)
+
+        self.assertEqual([q['highlight'] for q in data['questions']],
+            ['&lt;b&gt;<mark>xq</mark>&lt;/b&gt;'])
+
+    def test_search_questions_without_matches(self):
+        res = self.client().post('/questions',
+            json={'searchTerm': 'xylophonequasar'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['questions'], [])
+        self.assertEqual(data['total_questions'], 0)
+
+    def test_422_search_with_invalid_page(self):
+        res = self.client().post('/questions',
+            json={'searchTerm': 'title', 'page': 'last'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def test_load_questions_in_bulk(self):
+        body = '\n'.join(json.dumps(record) for record in [
+            {'question': 'Bulk question?', 'answer': 'Yes',
+             'category': 1, 'difficulty': 2},
+            {'question': 'Another bulk question?', 'answer': 'Yes',
+             'category': 'Art', 'difficulty': 5},
+            {'question': 'Bad bulk question?', 'answer': 'No',
+             'category': 1, 'difficulty': 9},
+        ])
+        res = self.client().post('/questions/bulk?batch_size=1', data=body,
+            content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        with self.app.app_context():
+            loaded = Question.query.filter(
+                Question.question.like('%bulk question?')).all()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['loaded'], 2)
+        self.assertEqual(data['rejected'], 1)
+        self.assertEqual(data['errors'][0]['line'], 3)
+        self.assertEqual(len(loaded), 2)
+
+    def test_422_load_questions_with_invalid_batch_size(self):
+        res = self.client().post('/questions/bulk?batch_size=0', data='',
+            content_type='text/csv')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+    def play_quiz(self, category_id):
+        """Plays a quiz to the end and returns the questions it asked."""
+        asked = []
+        while True:
+            res = self.client().post('/quizzes', json={
+                'previous_questions': [q['id'] for q in asked],
+                'quiz_category': {'id': category_id, 'type': ''}})
+            self.assertEqual(res.status_code, 200)
+            question = json.loads(res.data)['question']
+            if question is None:
+                return asked
+            asked.append(question)
+
+    def test_play_quiz_asks_each_question_of_category_once(self):
+        asked = self.play_quiz(1)
+        ids = [q['id'] for q in asked]
+
+        self.assertTrue(asked)
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertTrue(all(q['category'] == 1 for q in asked))
+        with self.app.app_context():
+            self.assertEqual(len(ids), Question.query.filter(
+                Question.category == 1).count())
+
+    def test_play_quiz_in_all_categories(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': 0, 'type': 'click'}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['question'])
+
+    def test_404_play_quiz_in_unknown_category(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 1000}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertFalse(data['success'])
+
+    def test_422_play_quiz_with_invalid_previous_questions(self):
+        res = self.client().post('/quizzes', json={
+            'previous_questions': ['first'], 'quiz_category': {'id': 1}})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertFalse(data['success'])
+
+
+class InvertedIndexTestCase(unittest.TestCase):
+    """The in-process search used when the database isn't postgres"""
+
+    def setUp(self):
+        self.index = InvertedIndex([
+            (1, 'Which title is the best title?'),
+            (2, 'Who titled the painting?'),
+            (3, 'What is the title of the longest book title ever written?'),
+            (4, 'Which planet is closest to the sun?'),
+        ])
+
+    def test_matches_word_prefixes(self):
+        ids = [id for id, score in self.index.search('TITL')]
+        self.assertEqual(sorted(ids), [1, 2, 3])
+
+    def test_matches_every_word(self):
+        ids = [id for id, score in self.index.search('title best')]
+        self.assertEqual(ids, [1])
+
+    def test_ranks_more_occurrences_in_shorter_questions_first(self):
+        ids = [id for id, score in self.index.search('title')]
+        self.assertEqual(ids, [1, 3, 2])
+
+    def test_without_matches(self):
+        self.assertEqual(self.index.search('moon'), [])
+        self.assertEqual(self.index.search('sun moon'), [])
+
+    def test_highlights_matched_words(self):
+        self.assertEqual(self.index.highlight(2, 'title paint'),
+            'Who <mark>titled</mark> the <mark>painting</mark>?')
+
+    def test_highlights_escape_html(self):
+        index = InvertedIndex([(1, '<b>x</b> & <script>')])
+        self.assertEqual(index.highlight(1, 'x'),
+            '&lt;b&gt;<mark>x</mark>&lt;/b&gt; &amp; &lt;script&gt;')
+
+
+class LoaderTestCase(unittest.TestCase):
+    """Reading and checking the records of a bulk load"""
+
+    categories = {'1': 'Science', '2': 'Art'}
+
+    def convert(self, record):
+        return convert_record(1, record, self.categories)
+
+    def test_reads_csv_and_ndjson(self):
+        csv_records = list(read_records(io.StringIO(
+            'question,answer,category,difficulty\n"Why, csv?",Yes,1,2\n'),
+            'csv'))
+        ndjson_records = list(read_records(io.StringIO(
+            '{"question": "Why ndjson?"}\n\nnot json\n'), 'ndjson'))
+
+        self.assertEqual(csv_records, [(2, {'question': 'Why, csv?',
+            'answer': 'Yes', 'category': '1', 'difficulty': '2'})])
+        self.assertEqual(ndjson_records[0], (1, {'question': 'Why ndjson?'}))
+        self.assertEqual(ndjson_records[1][0], 3)
+        self.assertIsInstance(ndjson_records[1][1], RecordError)
+
+    def test_converts_categories_by_id_or_type(self):
+        row = self.convert({'question': ' Why? ', 'answer': 'Yes',
+            'category': 'art', 'difficulty': '3'})
+        self.assertEqual(row, {'question': 'Why?', 'answer': 'Yes',
+            'category': 2, 'difficulty': 3})
+        self.assertEqual(self.convert({'question': 'Why?', 'answer': 'Yes',
+            'category': 1, 'difficulty': 1})['category'], 1)
+
+    def test_rejects_invalid_records(self):
+        valid = {'question': 'Why?', 'answer': 'Yes', 'category': 1,
+            'difficulty': 1}
+        for change in ({'answer': ''}, {'category': 7}, {'difficulty': 6},
+                {'difficulty': 'hard'}, {'id': 3}):
+            with self.assertRaises(RecordError):
+                self.convert(dict(valid, **change))
+
+
+# Tests written as pytest functions, isolated by the fixtures of conftest.py
+
+def test_total_questions_counts_new_questions(app, client):
+    before = client.get('/questions').get_json()
+    with app.app_context():
+        Question('Is this cached?', 'No', 1, 1).insert()
+    after = client.get('/questions').get_json()
+
+    assert after['total_questions'] == before['total_questions'] + 1
+
+
+# drawn ids, and by rank once the draws are used up
+@pytest.mark.parametrize('rounds', [quizzes.DRAW_ROUNDS, 0])
+def test_quiz_picks_questions_uniformly(app, session, rounds):
+    # the ids of a category are far apart, and unevenly
+    rng = random.Random(4)
+    with app.app_context(), mock.patch('quizzes.DRAW_ROUNDS', rounds):
+        ids = [id for id, in Question.query.with_entities(Question.id)
+            .filter(Question.category == 4).order_by(Question.id)]
+        for previous in ([], ids[:1]):
+            left = [id for id in ids if id not in previous]
+            draws = 300 * len(left)
+            picks = Counter(random_question_id(4, previous, rng)
+                for _ in range(draws))
+
+            assert set(picks) == set(left)
+            for id in left:
+                assert picks[id] / draws == \
+                    pytest.approx(1 / len(left), abs=0.3 / len(left))
+
+
+def test_get_questions_query_budget(client, query_budget):
+    # a page of questions, their number and the categories, not a query per
+    # question or category
+    query_budget(3)
+    res = client.get('/questions')
+
+    assert res.status_code == 200
+    assert len(res.get_json()['questions']) == 10
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+'''
+Isolated databases for the tests, so they can run in parallel.
+
+Each test process (each pytest-xdist worker, or the one process of a serial
+run) gets its own copy of the test database, cloned from it as a template
+when the process first needs it: trivia_test_gw0, trivia_test_gw1, ... for
+workers and trivia_test_main otherwise. Cloning copies the database's files,
+which is far quicker than restoring trivia.psql.
+
+Each test then runs in a transaction that is rolled back when it ends, so
+tests see the same questions whatever ran before them. The app's commits
+release a SAVEPOINT inside that transaction instead of committing, and its
+rollbacks roll back to the SAVEPOINT.
+
+The template is the database in TEST_DATABASE_URL (default trivia_test on
+localhost), set up as the README describes. Clones are dropped and cloned
+again by the next run, and left in place after it for inspecting failures.
+'''
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, scoped_session
+
+import cache
+import search
+from flaskr import create_app
+from models import db
+
+template_url = os.environ.get('TEST_DATABASE_URL',
+    'postgres://localhost:5432/trivia_test')
+
+_app = None
+
+
+def _with_database(url, database):
+    url = make_url(url)
+    if hasattr(url, 'set'):
+        return url.set(database=database)
+    url.database = database
+    return url
+
+
+def worker_name():
+    '''the pytest-xdist worker running the tests, or main'''
+    return os.environ.get('PYTEST_XDIST_WORKER', 'main')
+
+
+def clone_database(template=None, name=None):
+    '''
+    clone_database(template, name)
+        (re)creates the database name as a copy of the template database and
+        returns its url
+    '''
+    template = make_url(template or template_url)
+    name = name or '%s_%s' % (template.database, worker_name())
+    # CREATE DATABASE can't run in a transaction, nor connected to either
+    # database
+    admin = create_engine(_with_database(template, 'postgres'),
+        isolation_level='AUTOCOMMIT')
+    try:
+        with admin.connect() as connection:
+            connection.execute(text('DROP DATABASE IF EXISTS "%s"' % name))
+            connection.execute(text('CREATE DATABASE "%s" TEMPLATE "%s"'
+                % (name, template.database)))
+    finally:
+        admin.dispose()
+    return _with_database(template, name)
+
+
+def shared_app():
+    '''the app of this test process, on its clone of the test database'''
+    global _app
+    if _app is None:
+        _app = create_app({
+            'SQLALCHEMY_DATABASE_URI': str(clone_database())})
+    return _app
+
+
+class SharedSession(scoped_session):
+    '''
+    db.session during a test: one session in every request and app context
+    of the test, which outlives the requests removing it as they end
+    '''
+
+    def remove(self):
+        self.registry().expire_all()
+
+
+@contextmanager
+def isolated(app):
+    '''
+    isolated(app)
+        runs the block in a transaction on the app's database that is rolled
+        back at its end, with db.session bound to it
+    '''
+    with app.app_context():
+        connection = db.engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection)
+    session.begin_nested()
+
+    @event.listens_for(session, 'after_transaction_end')
+    def restart_savepoint(session, ended):
+        if ended.nested and not ended._parent.nested:
+            # what a commit does for the app, which its caches rely on
+            session.expire_all()
+            cache.forget_changes(session)
+            session.begin_nested()
+
+    app_session = db.session
+    db.session = SharedSession(lambda: session)
+    cache.clear()
+    search.forget_search_index()
+    try:
+        yield session
+    finally:
+        db.session = app_session
+        session.close()
+        transaction.rollback()
+        connection.close()
+        cache.clear()
+        search.forget_search_index()
@@ -1,11 +1,15 @@
 import os
 from flask import Flask
-from models import setup_db
+from flask_cors import CORS
+from models import setup_db, db_init_command
+from sqlstats import init_sql_stats
 
 def create_app(test_config=None):
 
     app = Flask(__name__)
     setup_db(app)
+    init_sql_stats(app)
+    app.cli.add_command(db_init_command)
     CORS(app)
 
     @app.route('/')
@@ -0,0 +1,97 @@
+"""Measures how long a fresh capstone dyno takes to start.
+
+Starts the app in new Python processes, the way an autoscaled dyno or a
+test run does, and reports the median and slowest time to import it, build
+it and, with --path, serve its first request, along with the database
+connections opened before that request. Run from the starter folder:
+
+    python benchmarks/bench_startup.py --runs 20 --target-ms 500
+
+With --target-ms it exits with status 1 when the median start (import and
+build) is slower than the target, so it can guard cold starts in CI.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# run in each fresh process; prints the timings as json
+CHILD = '''
+import importlib, json, sys, time
+started = time.perf_counter()
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+connections = []
+event.listen(Engine, 'connect', lambda *args: connections.append(1))
+
+module_name, _, attribute = sys.argv[1].partition(':')
+module = importlib.import_module(module_name)
+imported = time.perf_counter()
+app = getattr(module, attribute)
+if not hasattr(app, 'wsgi_app'):
+    app = app()
+built = time.perf_counter()
+result = {
+    'import_ms': (imported - started) * 1000,
+    'build_ms': (built - imported) * 1000,
+    'connections': len(connections),
+}
+if sys.argv[2]:
+    status = app.test_client().get(sys.argv[2]).status_code
+    result['first_request_ms'] = (time.perf_counter() - built) * 1000
+    result['status'] = status
+print(json.dumps(result))
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--app', default='app:app',
+        help='module:factory or module:app to start (default app:app, '
+        'which builds the app as it is imported)')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='',
+        help='also time a first GET request to this path, e.g. /coolkids '
+        '(needs the database)')
+    parser.add_argument('--target-ms', type=float,
+        help='fail if the median start takes longer')
+    return parser.parse_args()
+
+
+def start_once(args):
+    output = subprocess.check_output(
+        [sys.executable, '-c', CHILD, args.app, args.path], cwd=HERE,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1'), text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    runs = [start_once(args) for _ in range(args.runs)]
+    for run in runs:
+        run['start_ms'] = run['import_ms'] + run['build_ms']
+
+    report = {'app': args.app, 'runs': args.runs,
+        'connections_before_first_request': max(r['connections'] for r in runs)}
+    keys = ['import_ms', 'build_ms', 'start_ms']
+    if args.path:
+        keys.append('first_request_ms')
+        report['statuses'] = sorted(set(r['status'] for r in runs))
+    for key in keys:
+        values = [r[key] for r in runs]
+        report[key] = {'median': round(statistics.median(values), 1),
+            'max': round(max(values), 1)}
+    print(json.dumps(report, indent=2))
+
+    if args.target_ms is not None and \
+            report['start_ms']['median'] > args.target_ms:
+        sys.exit('median start of %.1f ms is over the %.1f ms target'
+            % (report['start_ms']['median'], args.target_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,41 @@
-from sqlalchemy import Column, String, create_engine
+import os
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Column, String, Integer, create_engine
 from flask_sqlalchemy import SQLAlchemy
 import json
 
-database_path = os.environ['DATABASE_URL']
-
 db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service, using the database
+    given or else the one in DATABASE_URL, read when the app is built rather
+    than when this module is imported. Nothing connects to the database
+    until the first query, and the tables are created by `flask db-init`,
+    not here, so starting a dyno costs no round trip to the database.
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    if database_path is None:
+        database_path = os.environ.get('DATABASE_URL')
+    if not database_path:
+        raise RuntimeError('DATABASE_URL is not set')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+
+
+'''
+db_init_command()
+    creates the tables of the models that don't exist yet; run it once with
+    `flask db-init` when setting up a database
+'''
+@click.command('db-init')
+@with_appcontext
+def db_init_command():
     db.create_all()
+    click.echo('created the tables')
 
 
 '''
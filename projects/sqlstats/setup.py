@@ -0,0 +1,12 @@
+from setuptools import setup
+
+setup(
+    name='sqlstats',
+    version='0.1.0',
+    description='SQL statement counting and slow-query logging for Flask '
+        'apps using SQLAlchemy',
+    py_modules=['sqlstats', 'sqlstats_pytest'],
+    install_requires=['Flask', 'SQLAlchemy'],
+    # gives pytest the query_budget fixture
+    entry_points={'pytest11': ['sqlstats = sqlstats_pytest']},
+)
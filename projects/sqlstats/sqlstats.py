@@ -0,0 +1,146 @@
+import functools
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, \
+    request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+SQL statement counting and slow-query logging, shared by the apps of this
+repository.
+
+init_sql_stats(app) hooks every SQLAlchemy engine, so each response carries
+the number of statements its request ran and the time they took:
+
+    X-SQL-Query-Count: 3
+    X-SQL-Query-Time: 4.2
+
+(the time is in milliseconds), and statements slower than the app's
+SLOW_QUERY_MS (default 200, or the SLOW_QUERY_MS environment variable) are
+logged as warnings. A streamed response runs most of its statements after its
+headers are sent, so it has no such headers; the totals of its request are
+logged at INFO once it has been sent in full.
+
+collect_statements() lists the statements a block runs, and query_budget(n)
+fails the block it wraps if it runs more than n of them, for tests. Under
+pytest, the query_budget fixture of sqlstats_pytest.py declares the same
+budget for the rest of a test.
+'''
+
+logger = logging.getLogger('sqlstats')
+
+# statements run in collect_statements blocks, innermost last
+_collectors = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    conn.info.setdefault('sqlstats_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+        executemany):
+    elapsed = time.perf_counter() - conn.info['sqlstats_started'].pop()
+
+    if has_request_context():
+        stats = _request_stats()
+        stats['count'] += 1
+        stats['time'] += elapsed
+    for statements in _collectors:
+        statements.append(statement)
+
+    if elapsed * 1000 >= _slow_query_ms():
+        logger.warning('slow query (%.1f ms): %s %r', elapsed * 1000,
+            statement, parameters)
+
+
+def _handle_error(exception_context):
+    # a failed statement never reaches after_cursor_execute; drop its start
+    # time, or it stays on the pooled connection
+    connection = exception_context.connection
+    if connection is None or exception_context.statement is None:
+        return
+    started = connection.info.get('sqlstats_started')
+    if started:
+        started.pop()
+
+
+def _slow_query_ms():
+    if has_app_context():
+        return current_app.config.get('SLOW_QUERY_MS', 200)
+    return int(os.environ.get('SLOW_QUERY_MS', 200))
+
+
+def _request_stats():
+    # one dict per request, so a streamed response can still read it once
+    # the request's context is gone
+    if 'sql_stats' not in g:
+        g.sql_stats = {'count': 0, 'time': 0.0}
+    return g.sql_stats
+
+
+def _log_totals(method, path, stats):
+    logger.info('%s %s ran %d queries in %.1f ms', method, path,
+        stats['count'], stats['time'] * 1000)
+
+
+def _add_headers(response):
+    stats = _request_stats()
+    if response.is_streamed:
+        # the body's statements run after the headers are sent, so headers
+        # would only count the ones before it; log the totals once it is
+        # sent instead
+        response.call_on_close(functools.partial(_log_totals, request.method,
+            request.full_path.rstrip('?'), stats))
+        return response
+    response.headers['X-SQL-Query-Count'] = str(stats['count'])
+    response.headers['X-SQL-Query-Time'] = '%.1f' % (stats['time'] * 1000)
+    return response
+
+
+def init_sql_stats(app):
+    '''
+    init_sql_stats(app)
+        counts the statements run by each of the app's requests and logs the
+        slow ones
+    '''
+    app.config.setdefault('SLOW_QUERY_MS',
+        int(os.environ.get('SLOW_QUERY_MS', 200)))
+    app.after_request(_add_headers)
+    if not event.contains(Engine, 'before_cursor_execute',
+            _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+@contextmanager
+def collect_statements():
+    '''
+    collect_statements()
+        collects the statements the block runs, in the list it yields
+    '''
+    statements = []
+    _collectors.append(statements)
+    try:
+        yield statements
+    finally:
+        _collectors.remove(statements)
+
+
+@contextmanager
+def query_budget(budget):
+    '''
+    query_budget(n)
+        fails with an AssertionError listing the statements if the block
+        runs more than n of them
+    '''
+    with collect_statements() as statements:
+        yield statements
+    if len(statements) > budget:
+        raise AssertionError('%d queries run, over the budget of %d:\n%s'
+            % (len(statements), budget, '\n'.join(statements)))
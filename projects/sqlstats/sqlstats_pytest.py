@@ -0,0 +1,24 @@
+'''
+The query_budget fixture, for the tests of apps using sqlstats. pytest loads
+this module by itself once the sqlstats package is installed.
+'''
+from contextlib import ExitStack
+
+import pytest
+
+import sqlstats
+
+
+@pytest.fixture
+def query_budget():
+    '''
+    Declares how many SQL statements the rest of the test may run, e.g.
+
+        def test_home(client, query_budget):
+            query_budget(2)
+            client.get('/')
+
+    The test fails when it ends if it ran more, listing the statements.
+    '''
+    with ExitStack() as stack:
+        yield lambda budget: stack.enter_context(sqlstats.query_budget(budget))